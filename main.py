@@ -1,4 +1,20 @@
 from src.cribbage_game import CribbageGame
+from src.card import Deck
+from src.checkpoint import CheckpointManager
+from src.actor_learner import train_actor_learner
+from src.game_log import GameRecorder
+from src.metrics import MetricsWriter, MetricsReader, ResultsFileReader
+from src.game_server import GameServer
+from src.match_equity import MatchEquityTable
+from src.pipeline import discard_dataset
+from src.rng import game_rng
+from src.memory_profile import MemoryProfiler
+from src.evaluation import evaluate_discards, compare_policies, draw_scenarios, load_scenarios, save_scenarios, network_policy, naive_policy
+from src.evaluation import checkpoint_paths, select_best_checkpoint
+from src.replay import PrioritizedReplayBuffer
+from src.sweep import SEARCH_SPACE, MedianPruner, sample_configs, run_sweep
+import asyncio
+import os
 import src.player as player
 import src.scoring as scoring
 import random
@@ -31,22 +47,71 @@ def create_training_batch(num_hands : int = 1_000):
 
 
 
-def train(inputs, i):
+def train(inputs, num_batches, checkpoint_dir, metrics_dir, memory_dir=None, replay_capacity=0):
+    ### One trainee and checkpoint manager for the whole run, so each checkpoint is written while the next batches train
     trainee = player.NetworkPlayer('Trainee')
-    trainee.train_discard_model(inputs, i)
+    checkpoints = CheckpointManager(checkpoint_dir, keep_last=20, keep_best=5, best_metric='model_avg')
+    ### Every batch is flushed, so dashboards tailing the metrics stay current and a crash loses nothing
+    metrics = MetricsWriter(metrics_dir, flush_every=1)
+    memory_profiler = None if memory_dir == None else MemoryProfiler(memory_dir, interval=5)
+    ### The replay buffer lives as long as the run, so later batches replay transitions from earlier ones
+    replay_buffer = None if replay_capacity == 0 else PrioritizedReplayBuffer(replay_capacity, trainee._discard_network.input_shape[-1])
+    for i in tqdm(range(num_batches)):
+        trainee.train_discard_model(inputs, i, checkpoints, replay_buffer=replay_buffer, metrics=metrics, memory_profiler=memory_profiler)
+    metrics.close()
+    checkpoints.close()
+    if memory_profiler != None:
+        memory_profiler.close()
+
+def train_discards_solo(num_batches : int = 1_000, checkpoint_dir : str = 'checkpoints/solo', metrics_dir : str = 'metrics', memory_dir : str = None,
+                        replay_capacity : int = 0):
+    with open('inputs.txt', 'rb') as f:
+        inputs = pickle.load(f)
 
-def train_discards_solo(num_batches : int = 1_000):
+    ### Training runs in a process of its own, which lives for every batch of the run
+    process = multiprocessing.Process(target=train, args=[inputs, num_batches, checkpoint_dir, metrics_dir, memory_dir, replay_capacity])
+    process.start()
+    process.join()
+    process.kill()
+
+def train_discards_distributed(num_actors : int = 4, num_steps : int = 10_000, checkpoint_dir : str = 'checkpoints/distributed', memory_dir : str = None):
     with open('inputs.txt', 'rb') as f:
         inputs = pickle.load(f)
-    
-    for i in tqdm(range(num_batches)):
-        process = multiprocessing.Process(target=train, args=[inputs, i])
-        process.start()
-        process.join()
-        process.kill()
 
+    checkpoints = CheckpointManager(checkpoint_dir, keep_last=20, keep_best=5, best_metric='reward_avg')
+    memory_profiler = None if memory_dir == None else MemoryProfiler(memory_dir, interval=100)
+    train_actor_learner(inputs, num_actors=num_actors, num_steps=num_steps, checkpoints=checkpoints, memory_profiler=memory_profiler)
+    checkpoints.close()
+    if memory_profiler != None:
+        memory_profiler.close()
 
-def vs_tester(player_one_type : str = 'random', player_two_type : str = 'random'):
+def train_discards_streaming(num_epochs : int = 1_000, batch_size : int = 32, checkpoint_dir : str = 'checkpoints/streaming', metrics_dir : str = 'metrics',
+                             memory_dir : str = None):
+    with open('inputs.txt', 'rb') as f:
+        inputs = pickle.load(f)
+
+    trainee = player.NetworkPlayer('Trainee')
+    checkpoints = CheckpointManager(checkpoint_dir, keep_last=20)
+    metrics = MetricsWriter(metrics_dir, flush_every=1)
+    memory_profiler = None if memory_dir == None else MemoryProfiler(memory_dir, interval=10)
+    trainee.train_discard_model_streaming(discard_dataset(inputs, batch_size), num_epochs, checkpoints=checkpoints, metrics=metrics,
+                                          memory_profiler=memory_profiler)
+    metrics.close()
+    checkpoints.close()
+    if memory_profiler != None:
+        memory_profiler.close()
+
+def sweep_hyperparameters(num_trials : int = 20, num_batches : int = 100, threads_per_trial : int = 2, directory : str = 'sweep'):
+    with open('inputs.txt', 'rb') as f:
+        inputs = pickle.load(f)
+
+    results = run_sweep(inputs, sample_configs(SEARCH_SPACE, num_trials), num_batches, directory,
+                        threads_per_trial=threads_per_trial, pruner=MedianPruner())
+    for result in results[:5]:
+        print(result['score'], result['config'])
+
+
+def vs_tester(player_one_type : str = 'random', player_two_type : str = 'random', log_path : str = None, seed : int = None, memory_dir : str = None):
     if player_one_type == 'random':
         player_one = player.RandomPlayer('Random Player 1')
     elif player_one_type == 'network':
@@ -68,7 +133,10 @@ def vs_tester(player_one_type : str = 'random', player_two_type : str = 'random'
 
     player_one_wins = 0
     player_two_wins = 0
-    game = CribbageGame(player_one, player_two)
+    recorder = None if log_path == None else GameRecorder(log_path)
+    memory_profiler = None if memory_dir == None else MemoryProfiler(memory_dir, interval=50)
+    ### With a seed, every game has its own random stream so any one of them can be replayed with game_rng(seed, i)
+    game = CribbageGame(player_one, player_two, recorder=recorder, rng=None if seed == None else game_rng(seed, 0))
 
     for i in tqdm(range(1_000)):
         while (game.get_winner() == None):
@@ -99,7 +167,14 @@ def vs_tester(player_one_type : str = 'random', player_two_type : str = 'random'
             player_one_wins += 1
         else:
             player_two_wins += 1
-        game.start_new_game()
+        game.start_new_game(None if seed == None else game_rng(seed, i + 1))
+        if memory_profiler != None:
+            memory_profiler.step('vs_tester')
+
+    if recorder != None:
+        recorder.close()
+    if memory_profiler != None:
+        memory_profiler.close()
 
     print('The final score was: ')
     print(str(player_one) + ': ' + str(player_one_wins))
@@ -107,6 +182,29 @@ def vs_tester(player_one_type : str = 'random', player_two_type : str = 'random'
 
 
 
+def run_game_server(port : int = 8121, bot_tables : int = 0, network_model : str = 'test_network_best.h5'):
+    """
+    Hosts tables for humans connecting on the given port, alongside bot_tables tables of naive against random bots
+    """
+    server = GameServer(port=port, network_model=network_model)
+    try:
+        asyncio.run(server.serve_forever(bot_tables))
+    finally:
+        server.close()
+
+
+
+def build_match_equity_table(path : str = 'match_equity.npy', num_rounds : int = 20_000):
+    """
+    Builds the win probability table from naive players' point distributions and prints a few states
+    """
+    table = MatchEquityTable.build(path, num_rounds=num_rounds)
+    for my_score, opp_score in [(0, 0), (60, 60), (100, 110), (115, 100)]:
+        print(f'{my_score} to {opp_score}: dealing {table.win_probability(my_score, opp_score, 1):.3f}, '
+              f'not dealing {table.win_probability(my_score, opp_score, 0):.3f}')
+
+
+
 def network_init_test():
     ### Create network player and game
     player_one = player.NetworkPlayer('Network Player')
@@ -150,22 +248,96 @@ def network_init_test():
     print('Average Hand Difference: ', str(sum(score_diff) / len(score_diff)))
 
 
-def graph_results():
-    top_end = list()
-    predicted = list()
-    with open('results.txt') as f:
-        for line in f:
-            t, p = [float(i) for i in line.split(',')]
-            top_end.append(t)
-            predicted.append(p)
+def evaluate_network(model_path : str = 'network18.h5', num_hands : int = 1_000_000, output_path : str = 'evaluation.json', seed : int = None):
+    network = player.NetworkPlayer('Network Player')
+    network.load_discard_model(model_path)
 
-    plt.plot(top_end, label='maximum score avg')
-    plt.plot(predicted, label='chosen score avg')
+    with open('inputs.txt', 'rb') as f:
+        inputs = pickle.load(f)
+
+    report = evaluate_discards(network._discard_network, inputs, num_hands, seed=seed, output_path=output_path)
+    for policy in ['network', 'naive', 'random']:
+        summary = report[policy]
+        print(f"{policy}: mean {summary['mean']:.3f} (95% CI {summary['ci95'][0]:.3f} to {summary['ci95'][1]:.3f}), "
+              f"regret {summary['regret']:.3f}, best discard {summary['best_rate']:.1%}")
+    difference = report['network']['vs_naive']
+    print(f"network - naive: {difference['mean']:+.3f} +/- {difference['standard_error']:.3f} (paired)")
+
+
+def compare_networks(model_paths : list[str] = ['network18.h5', 'network19.h5'], num_scenarios : int = 100_000, scenario_path : str = 'scenarios.npz',
+                     output_path : str = 'comparison.json', seed : int = None):
+    ### Every network is scored on the same saved scenarios, so runs stay comparable to each other
+    if os.path.exists(scenario_path):
+        scenarios = load_scenarios(scenario_path)
+    else:
+        with open('inputs.txt', 'rb') as f:
+            inputs = pickle.load(f)
+        scenarios = draw_scenarios(inputs, num_scenarios, seed)
+        save_scenarios(scenario_path, scenarios)
+
+    policies = {'naive': naive_policy}
+    for model_path in model_paths:
+        network = player.NetworkPlayer(model_path)
+        network.load_discard_model(model_path)
+        policies[model_path] = network_policy(network._discard_network)
+
+    report = compare_policies(policies, scenarios, 'naive', output_path=output_path)
+    for model_path in model_paths:
+        difference = report[model_path]['vs_naive']
+        print(f"{model_path}: {difference['mean']:+.3f} +/- {difference['standard_error']:.3f} points per hand over naive "
+              f"({difference['sample_savings']:.1f}x fewer scenarios than unpaired)")
+
+
+def select_checkpoint(checkpoint_dir : str = 'checkpoints/solo', best_path : str = 'test_network_best.h5', scenario_path : str = 'scenarios.npz',
+                      num_scenarios : int = 100_000, output_path : str = 'selection.json', seed : int = None):
+    if os.path.exists(scenario_path):
+        scenarios = load_scenarios(scenario_path)
+    else:
+        with open('inputs.txt', 'rb') as f:
+            inputs = pickle.load(f)
+        scenarios = draw_scenarios(inputs, num_scenarios, seed)
+        save_scenarios(scenario_path, scenarios)
+
+    report = select_best_checkpoint(checkpoint_paths(checkpoint_dir), scenarios, best_path, output_path=output_path)
+    for model_path in report['ranking']:
+        difference = report[model_path]['vs_naive']
+        print(f"{model_path}: {difference['mean']:+.3f} +/- {difference['standard_error']:.3f} points per hand over naive")
+    print(f"Copied {report['ranking'][0]} to {best_path}")
+
+
+def graph_results(metrics_dir : str = 'metrics', refresh_seconds : float = None, results_path : str = 'results.txt'):
+    """
+    Plots the training averages. With refresh_seconds set, keeps tailing the metrics and redrawing as new batches are written.
+    Runs trained without a metrics writer are read from the results file instead, when there's no metrics directory.
+    """
+    if os.path.exists(os.path.join(metrics_dir, 'schema.json')):
+        reader = MetricsReader(metrics_dir)
+    else:
+        reader = ResultsFileReader(results_path)
+    results = reader.read_all()
+    top_end = list(results['tester_avg'])
+    predicted = list(results['model_avg'])
+
+    top_end_line, = plt.plot(top_end, label='maximum score avg')
+    predicted_line, = plt.plot(predicted, label='chosen score avg')
     plt.xlabel('batch')
     plt.ylabel('scores')
     plt.title('Average Hand Scores per Batch During Training')
     plt.legend()
-    plt.show()
+
+    if refresh_seconds == None:
+        plt.show()
+        return
+
+    while plt.get_fignums():
+        new_results = reader.read_new()
+        top_end.extend(new_results['tester_avg'])
+        predicted.extend(new_results['model_avg'])
+        top_end_line.set_data(range(len(top_end)), top_end)
+        predicted_line.set_data(range(len(predicted)), predicted)
+        plt.gca().relim()
+        plt.gca().autoscale_view()
+        plt.pause(refresh_seconds)
         
 
 def test_with_training_batch():
@@ -225,10 +397,59 @@ def test_with_training_batch():
 
 
 
+def compiled_training_test(checkpoint_dir : str = 'checkpoints_test'):
+    ### Train the same network on the same full targets through the compiled step and through Keras fit
+    with open('inputs.txt', 'rb') as f:
+        inputs = pickle.load(f)
+
+    compiled = player.NetworkPlayer('Compiled')
+    uncompiled = player.NetworkPlayer('Uncompiled', compiled=False)
+    uncompiled._discard_network.set_weights(compiled._discard_network.get_weights())
+
+    for network in [compiled, uncompiled]:
+        network.use_rng(random.Random(0))
+        checkpoints = CheckpointManager(os.path.join(checkpoint_dir, network.name), keep_last=1)
+        network.train_discard_model(inputs, 0, checkpoints, full_targets=True, replay=3)
+        checkpoints.close()
+
+    difference = max(np.abs(a - b).max() for a, b in zip(compiled._discard_network.get_weights(), uncompiled._discard_network.get_weights()))
+    print('Largest weight difference: ', difference)
+    assert difference < 1e-4
+
+
+def starter_sweep_test(num_deals : int = 10_000):
+    ### Check the starter sweep against scoring every hand and crib with each starter one at a time
+    deck = Deck()
+    for _ in tqdm(range(num_deals)):
+        deck.shuffle()
+        kept, discards, crib = deck.cards[:4], deck.cards[4:6], deck.cards[4:8]
+        starters, hand_scores, _ = scoring.keep_starter_scores(kept, discards)
+        assert len(starters) == 46 and not any(starter.index == card.index for starter in starters for card in discards)
+        for starter, hand_score in zip(starters, hand_scores):
+            assert hand_score == scoring.Hand(kept + [starter]).score
+
+        starters, hand_scores, crib_scores = scoring.keep_starter_scores(kept, discards, crib)
+        assert len(starters) == 44
+        for starter, hand_score, crib_score in zip(starters, hand_scores, crib_scores):
+            assert hand_score == scoring.Hand(kept + [starter]).score
+            assert crib_score == scoring.Hand(crib + [starter]).score
+    print('Starter sweep matches Hand.score on', num_deals, 'deals')
+
+
 if __name__ == '__main__':
     # network_init_test()
     # create_training_batch()
     # train_discards_solo()
+    # train_discards_distributed()
+    # train_discards_streaming()
+    # sweep_hyperparameters()
     # vs_tester('network', 'naive')
+    # run_game_server()
+    # build_match_equity_table()
     # graph_results()
+    # evaluate_network()
+    # compare_networks()
+    # select_checkpoint()
+    # compiled_training_test()
+    # starter_sweep_test()
     test_with_training_batch()
\ No newline at end of file
@@ -0,0 +1,216 @@
+from src.card import Card
+from src.checkpoint import CheckpointManager
+from src.memory_profile import MemoryProfiler
+from src.player import NetworkPlayer
+from src.replay import PrioritizedReplayBuffer
+from src.shared_arrays import SharedArrays
+import multiprocessing
+import numpy as np
+import random
+
+
+
+class SharedRingQueue(SharedArrays):
+    """
+    A fixed capacity queue of encoded (input, action, reward) records kept in shared memory.
+    Records are copied straight into preallocated arrays, so nothing is pickled between processes.
+    """
+    def __init__(self, capacity : int=4_096, input_size : int=321, context=None):
+        context = multiprocessing.get_context() if context == None else context
+        self._capacity = capacity
+        self._input_size = input_size
+        self._condition = context.Condition()
+        super().__init__()
+        self._counters[:] = 0
+
+    def __len__(self) -> int:
+        return int(self._counters[1] - self._counters[0])
+
+    @property
+    def input_size(self) -> int:
+        """
+        Returns the length of each encoded input
+        """
+        return self._input_size
+
+    def _layout(self) -> list[tuple[str, tuple, type]]:
+        ### Counters hold the total number of records ever read and ever written
+        return [('_counters', (2,), np.int64), ('_inputs', (self._capacity, self._input_size), np.float32),
+                ('_actions', (self._capacity,), np.int32), ('_rewards', (self._capacity,), np.float32)]
+
+    def put(self, inputs : np.ndarray, actions : np.ndarray, rewards : np.ndarray, timeout : float=None) -> bool:
+        """
+        Appends a batch of records, waiting for room if the queue is full. Returns False if it timed out.
+        """
+        count = len(actions)
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._capacity - len(self) >= count, timeout):
+                return False
+            slots = (self._counters[1] + np.arange(count)) % self._capacity
+            self._inputs[slots] = inputs
+            self._actions[slots] = actions
+            self._rewards[slots] = rewards
+            self._counters[1] += count
+            self._condition.notify_all()
+        return True
+
+    def get(self, count : int, timeout : float=None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Removes and returns count records, waiting until that many are available. Returns None if it timed out.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: len(self) >= count, timeout):
+                return None
+            slots = (self._counters[0] + np.arange(count)) % self._capacity
+            records = (self._inputs[slots], self._actions[slots], self._rewards[slots])
+            self._counters[0] += count
+            self._condition.notify_all()
+        return records
+
+
+
+class SharedWeights(SharedArrays):
+    """
+    Model weights published by the learner into shared memory, stamped with a version so actors only copy new weights.
+    """
+    def __init__(self, shapes : list[tuple], context=None):
+        context = multiprocessing.get_context() if context == None else context
+        self._shapes = [tuple(shape) for shape in shapes]
+        self._lock = context.Lock()
+        super().__init__()
+        self._version[0] = -1
+
+    def _layout(self) -> list[tuple[str, tuple, type]]:
+        size = sum(int(np.prod(shape)) for shape in self._shapes)
+        return [('_version', (1,), np.int64), ('_flat', (size,), np.float32)]
+
+    @property
+    def version(self) -> int:
+        """
+        Returns the version of the weights last published, or -1 if none were
+        """
+        return int(self._version[0])
+
+    def publish(self, weights : list[np.ndarray]):
+        """
+        Copies the given weights into shared memory and bumps the version
+        """
+        with self._lock:
+            offset = 0
+            for weight in weights:
+                self._flat[offset:offset + weight.size] = weight.ravel()
+                offset += weight.size
+            self._version[0] += 1
+
+    def fetch(self, known_version : int=-1) -> tuple[list[np.ndarray], int]:
+        """
+        Returns a copy of the weights and their version if they are newer than the known version, otherwise None
+        """
+        with self._lock:
+            version = int(self._version[0])
+            if version <= known_version:
+                return None
+            weights = []
+            offset = 0
+            for shape in self._shapes:
+                size = int(np.prod(shape))
+                weights.append(self._flat[offset:offset + size].reshape(shape).copy())
+                offset += size
+        return weights, version
+
+
+
+def run_actor(hands : list[list[Card]], experience : SharedRingQueue, weights : SharedWeights, stop, seed : int, eps : float=0.1, episodes_per_put : int=32):
+    """
+    Plays discard episodes with the latest published policy and pushes the encoded records into the experience queue until stopped
+    """
+    random.seed(seed)
+    actor = NetworkPlayer('Actor ' + str(seed))
+    version = -1
+
+    while not stop.is_set():
+        update = weights.fetch(version)
+        if update != None:
+            new_weights, version = update
+            actor._discard_network.set_weights(new_weights)
+        actor._eps = eps
+
+        inputs = np.empty((episodes_per_put, experience.input_size), dtype=np.float32)
+        actions = np.empty((episodes_per_put,), dtype=np.int32)
+        rewards = np.empty((episodes_per_put,), dtype=np.float32)
+        for episode in range(episodes_per_put):
+            sample, reward = actor._chosen_discard_target(random.choice(hands))
+            inputs[episode] = sample.numpy()
+            actions[episode] = actor._chosen_arg
+            rewards[episode] = reward
+
+        ### Keep checking the stop flag while the learner is behind
+        while not stop.is_set() and not experience.put(inputs, actions, rewards, timeout=1.0):
+            pass
+
+    experience.close()
+    weights.close()
+
+
+def train_actor_learner(hands : list[list[Card]], num_actors : int=4, num_steps : int=10_000, batch_size : int=32, publish_every : int=50,
+                        queue_capacity : int=4_096, eps : float=0.1, checkpoints : CheckpointManager=None, checkpoint_every : int=1_000,
+                        replay_buffer : PrioritizedReplayBuffer=None, actor_timeout : float=10.0, memory_profiler : MemoryProfiler=None):
+    """
+    Trains the discard network with several actor processes generating experience and this process acting as the single learner.
+    The learner fits mini-batches from the shared experience queue and publishes its weights to the actors every publish_every steps.
+    If a replay buffer is given, records from the queue are added to it and the learner fits prioritized samples from it instead.
+    Raises a RuntimeError if no experience arrives for actor_timeout seconds and an actor process has exited.
+    If a memory profiler is given, every learner step is a step of it, profiling the learner process.
+    """
+    ### Actors are spawned rather than forked since tensorflow is already initialized in this process
+    context = multiprocessing.get_context('spawn')
+    learner = NetworkPlayer('Learner')
+    model = learner._discard_network
+
+    experience = SharedRingQueue(queue_capacity, model.input_shape[-1], context)
+    weights = SharedWeights([weight.shape for weight in model.get_weights()], context)
+    weights.publish(model.get_weights())
+    stop = context.Event()
+
+    actors = [context.Process(target=run_actor, args=[hands, experience, weights, stop, seed, eps], daemon=True) for seed in range(num_actors)]
+    for actor in actors:
+        actor.start()
+
+    try:
+        step = 0
+        while step < num_steps:
+            records = experience.get(batch_size, timeout=actor_timeout)
+            if records == None:
+                ### Actors only exit early when they crash, and then nothing might ever fill the queue again
+                exit_codes = [actor.exitcode for actor in actors if not actor.is_alive()]
+                if len(exit_codes) > 0:
+                    raise RuntimeError(f'Actor processes exited with exit codes {exit_codes}.')
+                continue
+            inputs, actions, rewards = records
+            step += 1
+
+            if replay_buffer != None:
+                replay_buffer.add(inputs, actions, rewards)
+                learner._fit_from_replay(replay_buffer, batch_size)
+            else:
+                ### Only the action that was played has a known outcome, so the other targets stay at the model's predictions
+                targets = learner._predict(inputs)
+                targets[np.arange(batch_size), actions] = rewards
+                learner._train_on_batch(inputs, targets)
+
+            if step % publish_every == 0:
+                weights.publish(model.get_weights())
+            if checkpoints != None and step % checkpoint_every == 0:
+                checkpoints.save(model, step, {'reward_avg': float(rewards.mean())})
+            if memory_profiler != None:
+                memory_profiler.step('learner')
+    finally:
+        stop.set()
+        for actor in actors:
+            actor.join()
+        experience.close()
+        experience.unlink()
+        weights.close()
+        weights.unlink()
+
+    return learner
@@ -22,12 +22,24 @@ class Face(Enum):
     QUEEN = {'value': 10, 'symbol': 'Q', 'str': 'Queen', 'rank': 12}
     KING = {'value': 10, 'symbol': 'K', 'str': 'King', 'rank': 13}
 
+_SUITS = list(Suit)
+_FACES = list(Face)
+
 
 
 class Card():
     def __init__(self, face : Face, suit : Suit):
         self._face = face
         self._suit = suit
+        self._index = suit.value['value'] * len(Face) + face.value['rank'] - 1
+
+    def __setstate__(self, state : dict):
+        """
+        Restores a pickled card, working out its index if it was pickled before cards stored one
+        """
+        self.__dict__.update(state)
+        if '_index' not in state:
+            self._index = self._suit.value['value'] * len(Face) + self._face.value['rank'] - 1
     
     def __str__(self) -> str:
         return str(self.face.value['symbol']) + str(self.suit.value['symbol'])
@@ -119,14 +131,38 @@ class Card():
         """
         return self.face.value['rank']
 
+    @property
+    def index(self) -> int:
+        """
+        Get the card's position in a new, unshuffled deck, from 0 to 51. This is also the order cards are sorted in.
+        """
+        return self._index
+
+    @staticmethod
+    def from_index(index : int) -> 'Card':
+        """
+        Creates the card at the given position of a new, unshuffled deck
+        """
+        return Card(_FACES[index % len(Face)], _SUITS[index // len(Face)])
+
 
 
 class Deck():
-    def __init__(self):
+    ### Only the given generator is stored rather than the random module, so decks can be pickled and copied.
+    ### Decks pickled before there was a generator have none.
+    _generator = None
+
+    def __init__(self, rng : random.Random=None):
+        """
+        Creates the 52 cards in order. Shuffles and cuts draw from the given random generator, or the global one.
+        """
         self._cards = []
+        self._generator = rng
         for suit in Suit:
             for face in Face:
                 self.cards.append(Card(face, suit))
+        ### A new deck is in index order, this keeps the deck's own card for every index
+        self._cards_by_index = tuple(self._cards)
 
     def __str__(self) -> str:
         s = '[Deck: '
@@ -148,17 +184,49 @@ class Deck():
         """
         Shuffles the cards
         """
-        random.shuffle(self.cards)
+        self._rng.shuffle(self.cards)
 
     def cut(self):
         """
         Cut the deck in half, put the bottom of the deck on top
         """
-        cut_point = random.randrange(len(self))
+        cut_point = self._rng.randrange(len(self))
         bottom = self.cards[:cut_point]
         top = self.cards[cut_point:]
         self._cards = top + bottom
 
+    def use_rng(self, rng : random.Random=None):
+        """
+        Draws shuffles and cuts from the given random generator from now on, None for the global one
+        """
+        self._generator = rng
+
+    @property
+    def _rng(self):
+        """
+        Returns the random generator the deck draws from, the global one unless another was given
+        """
+        return random if self._generator == None else self._generator
+
+    def reset_order(self):
+        """
+        Puts the cards in the deck back in the order of a new deck
+        """
+        self._cards.sort(key=lambda card: card.index)
+
+    @property
+    def order(self) -> bytes:
+        """
+        Returns the indexes of the cards in the deck, in order
+        """
+        return bytes(card.index for card in self._cards)
+
+    def restore_order(self, order : bytes):
+        """
+        Makes the deck hold the deck's own cards with the given indexes, in the given order
+        """
+        self._cards = [self._cards_by_index[index] for index in order]
+
     def deal_card(self) -> Card:
         """
         Deals the top card of the deck (last element in list). Removes it from the deck and returns it.
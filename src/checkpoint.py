@@ -0,0 +1,164 @@
+import json
+import os
+import queue
+import threading
+import time
+import tensorflow as tf
+
+
+
+class CheckpointManager():
+    """
+    Saves model checkpoints from a background thread so training never waits on disk.
+    Weights are snapshotted in memory when save is called, then written to a temporary file and renamed into place.
+    A manifest in the checkpoint directory records the step, path and metrics of every checkpoint still on disk.
+    """
+    def __init__(self, directory : str='checkpoints', keep_last : int=20, keep_best : int=0, best_metric : str=None, prefix : str='network', max_pending : int=2):
+        """
+        Keeps the keep_last most recently written checkpoints, plus the keep_best checkpoints with the highest best_metric.
+        At most max_pending snapshots are held in memory, after which save blocks until the writer catches up.
+        """
+        self._directory = directory
+        self._keep_last = keep_last
+        self._keep_best = keep_best
+        self._best_metric = best_metric
+        self._prefix = prefix
+
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = self._load_manifest()
+        ### The writer thread changes the manifest while the training thread may be reading it
+        self._manifest_lock = threading.Lock()
+
+        self._shadow_model = None
+        self._error = None
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._writer = threading.Thread(target=self._write_loop, name='checkpoint-writer', daemon=True)
+        self._writer.start()
+
+    @property
+    def manifest_path(self) -> str:
+        """
+        Returns the path of the manifest file
+        """
+        return os.path.join(self._directory, 'manifest.json')
+
+    @property
+    def checkpoints(self) -> list[dict]:
+        """
+        Returns the manifest entries of the checkpoints currently on disk, oldest first
+        """
+        with self._manifest_lock:
+            return list(self._manifest['checkpoints'])
+
+    def latest(self) -> str:
+        """
+        Returns the path of the most recent checkpoint, or None if there isn't one
+        """
+        with self._manifest_lock:
+            if len(self._manifest['checkpoints']) == 0:
+                return None
+            return self._manifest['checkpoints'][-1]['path']
+
+    def _load_manifest(self) -> dict:
+        """
+        Reads the manifest from the checkpoint directory, starting a new one if it doesn't exist
+        """
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                return json.load(f)
+        return {'checkpoints': []}
+
+    def _write_manifest(self):
+        """
+        Atomically replaces the manifest on disk with the in memory one
+        """
+        temp_path = self.manifest_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self._manifest, f, indent=1)
+        os.replace(temp_path, self.manifest_path)
+
+    def _raise_writer_error(self):
+        """
+        Re-raises any exception that happened in the writer thread on the calling thread
+        """
+        if self._error != None:
+            error = self._error
+            self._error = None
+            raise RuntimeError('Writing a checkpoint failed.') from error
+
+    def save(self, model : tf.keras.Model, step : int, metrics : dict=None):
+        """
+        Snapshots the model's weights and queues them to be written as the checkpoint for the given step
+        """
+        self._raise_writer_error()
+        ### The shadow model is only ever touched by the writer thread after this, so the trained model is never shared
+        if self._shadow_model == None:
+            self._shadow_model = tf.keras.models.clone_model(model)
+        self._queue.put((step, model.get_weights(), dict() if metrics == None else dict(metrics)))
+
+    def _write_loop(self):
+        """
+        Writes queued snapshots to disk until a None is received
+        """
+        while True:
+            item = self._queue.get()
+            try:
+                if item == None:
+                    return
+                self._write_checkpoint(*item)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write_checkpoint(self, step : int, weights : list, metrics : dict):
+        """
+        Writes a single checkpoint through a temporary file, records it in the manifest and applies the retention policy
+        """
+        path = os.path.join(self._directory, f'{self._prefix}{step}.h5')
+        temp_path = os.path.join(self._directory, f'.{self._prefix}{step}.tmp.h5')
+
+        self._shadow_model.set_weights(weights)
+        self._shadow_model.save(temp_path, include_optimizer=False)
+        os.replace(temp_path, path)
+
+        with self._manifest_lock:
+            ### A step that is saved twice replaces its old entry. Entries stay in the order they were written rather than by step,
+            ### so a new run in a directory with an older run's manifest keeps its own checkpoints and retires the older ones
+            entries = [entry for entry in self._manifest['checkpoints'] if entry['step'] != step]
+            entries.append({'step': step, 'path': path, 'time': time.time(), 'metrics': metrics})
+            self._manifest['checkpoints'] = entries
+            self._apply_retention()
+            self._write_manifest()
+
+    def _apply_retention(self):
+        """
+        Deletes every checkpoint that is neither among the most recent nor among the best
+        """
+        entries = self._manifest['checkpoints']
+        kept_steps = set(entry['step'] for entry in entries[-self._keep_last:]) if self._keep_last > 0 else set()
+
+        if self._keep_best > 0 and self._best_metric != None:
+            scored = [entry for entry in entries if self._best_metric in entry['metrics']]
+            scored.sort(key=lambda entry: entry['metrics'][self._best_metric], reverse=True)
+            kept_steps.update(entry['step'] for entry in scored[:self._keep_best])
+
+        for entry in entries:
+            if entry['step'] not in kept_steps and os.path.exists(entry['path']):
+                os.remove(entry['path'])
+        self._manifest['checkpoints'] = [entry for entry in entries if entry['step'] in kept_steps]
+
+    def wait(self):
+        """
+        Blocks until every queued checkpoint has been written
+        """
+        self._queue.join()
+        self._raise_writer_error()
+
+    def close(self):
+        """
+        Writes any remaining checkpoints and stops the writer thread
+        """
+        self._queue.put(None)
+        self._writer.join()
+        self._raise_writer_error()
@@ -0,0 +1,100 @@
+import weakref
+import numpy as np
+import tensorflow as tf
+
+
+
+### Inputs are padded up to one of these batch sizes, so every call reuses one of a few compiled graphs
+PREDICT_BUCKETS = (1, 8, 32, 128, 512)
+### Compiled functions for each model, per process. They only hold weak references to their model, so they go with it
+_COMPILED = weakref.WeakKeyDictionary()
+
+
+
+class CompiledDiscardModel():
+    """
+    tf.function compiled predict and train step functions for a compiled Keras discard model, with fixed input signatures so
+    they're only traced once, optionally compiled with XLA. This skips the Keras predict and fit machinery, whose per call
+    overhead dwarfs the work of the small discard network. Both read and update the model's own variables.
+    """
+    def __init__(self, model : tf.keras.Model, train_batch_size : int=32, jit_compile : bool=False):
+        self._model_ref = weakref.ref(model)
+        self._train_batch_size = train_batch_size
+        self._jit_compile = jit_compile
+        input_size = model.input_shape[-1]
+        output_size = model.output_shape[-1]
+
+        self._predict_functions = {size: tf.function(self._predict, jit_compile=jit_compile,
+                                                     input_signature=[tf.TensorSpec((size, input_size), tf.float32)])
+                                   for size in PREDICT_BUCKETS}
+        self._train_step = tf.function(self._train, jit_compile=jit_compile,
+                                       input_signature=[tf.TensorSpec((train_batch_size, input_size), tf.float32),
+                                                        tf.TensorSpec((train_batch_size, output_size), tf.float32),
+                                                        tf.TensorSpec((train_batch_size,), tf.float32)])
+        ### The optimizer's variables have to exist before tracing, as compiled functions can't create them
+        if not getattr(model.optimizer, 'built', True):
+            model.optimizer.build(model.trainable_variables)
+
+    @property
+    def _model(self) -> tf.keras.Model:
+        return self._model_ref()
+
+    @property
+    def train_batch_size(self) -> int:
+        return self._train_batch_size
+
+    def _predict(self, inputs : tf.Tensor) -> tf.Tensor:
+        return self._model(inputs, training=False)
+
+    def _train(self, inputs : tf.Tensor, targets : tf.Tensor, sample_weight : tf.Tensor) -> tf.Tensor:
+        with tf.GradientTape() as tape:
+            outputs = self._model(inputs, training=True)
+            loss = self._model.loss(targets, outputs, sample_weight=sample_weight)
+        gradients = tape.gradient(loss, self._model.trainable_variables)
+        self._model.optimizer.apply_gradients(zip(gradients, self._model.trainable_variables))
+        return loss
+
+    def warm_up(self):
+        """
+        Traces and compiles every function ahead of the first real call. Predictions run on zeros, the train step is only traced.
+        """
+        input_size = self._model.input_shape[-1]
+        for size, function in self._predict_functions.items():
+            function(tf.zeros((size, input_size)))
+        self._train_step.get_concrete_function()
+
+    def predict(self, inputs) -> np.ndarray:
+        """
+        Returns the model's outputs for a batch of inputs of any size, padding each chunk up to the nearest compiled batch size
+        """
+        inputs = np.asarray(inputs, dtype=np.float32)
+        largest = PREDICT_BUCKETS[-1]
+        outputs = []
+        for start in range(0, len(inputs), largest):
+            chunk = inputs[start:start + largest]
+            size = next(size for size in PREDICT_BUCKETS if size >= len(chunk))
+            padded = np.zeros((size, inputs.shape[1]), dtype=np.float32)
+            padded[:len(chunk)] = chunk
+            outputs.append(self._predict_functions[size](padded).numpy()[:len(chunk)])
+        return np.concatenate(outputs)
+
+    def train_step(self, inputs, targets, sample_weight=None) -> float:
+        """
+        Takes one optimizer step on a batch of exactly train_batch_size samples and returns the loss before the step
+        """
+        sample_weight = np.ones(self._train_batch_size) if sample_weight is None else sample_weight
+        ### Targets may be integer scores, so everything is cast rather than converted
+        loss = self._train_step(tf.cast(inputs, tf.float32), tf.cast(targets, tf.float32), tf.cast(sample_weight, tf.float32))
+        return float(loss)
+
+
+def compiled_discard_model(model : tf.keras.Model, train_batch_size : int=32, jit_compile : bool=False) -> CompiledDiscardModel:
+    """
+    Returns the compiled functions for the model, compiling and warming them up the first time they're asked for in this process
+    """
+    key = (train_batch_size, jit_compile)
+    compiled = _COMPILED.setdefault(model, dict())
+    if key not in compiled:
+        compiled[key] = CompiledDiscardModel(model, train_batch_size, jit_compile)
+        compiled[key].warm_up()
+    return compiled[key]
@@ -0,0 +1,161 @@
+from src.card import Card, Deck, Face, Suit
+from src.scoring import Hand
+from src.discards import unseen_cards
+import os
+import random
+import numpy as np
+
+
+
+_FACES = list(Face)
+### Crib cards are given these suits when only ranks matter, so they never make a flush and a jack never matches the starter
+_CRIB_SUITS = [Suit.DIAMOND, Suit.SPADE, Suit.CLUB, Suit.DIAMOND]
+_STARTER_SUIT = Suit.HEART
+
+
+def _rank_only_score(ranks : list[int], starter_rank : int=None) -> int:
+    """
+    Scores a crib from ranks alone, counting fifteens, pairs and runs but never a flush or nob
+    """
+    cards = [Card(_FACES[rank - 1], suit) for rank, suit in zip(ranks, _CRIB_SUITS)]
+    if starter_rank != None:
+        cards.append(Card(_FACES[starter_rank - 1], _STARTER_SUIT))
+    return Hand(cards).score
+
+
+def _rank_counts(cards : list[Card]) -> np.ndarray:
+    """
+    Returns how many of the given cards there are of each rank
+    """
+    counts = np.zeros(13, dtype=np.int64)
+    for card in cards:
+        counts[card.rank - 1] += 1
+    return counts
+
+
+
+class OpponentDiscardModel():
+    """
+    The distribution of which two ranks an opponent policy discards into the crib, split by whether the opponent is dealing.
+    It is built once by simulating the policy, saved to disk, and then used to sample opponent discards or to take
+    expectations over them. Expected cribs for discards with nothing known about the opponent are precomputed, so they're a lookup.
+    """
+    def __init__(self, pair_counts : np.ndarray, crib_table : np.ndarray=None):
+        """
+        pair_counts[dealer, r1, r2] is how often the policy discarded ranks r1 <= r2 (zero based) while dealer was its dealer flag
+        """
+        self._pair_counts = np.asarray(pair_counts, dtype=np.float64)
+        self._crib_table = self._build_crib_table() if crib_table is None else np.asarray(crib_table, dtype=np.float64)
+        self._cache = dict()
+
+    @staticmethod
+    def build(policy : 'Player', num_deals : int=10_000) -> 'OpponentDiscardModel':
+        """
+        Deals num_deals random hands to the policy, half as dealer and half not, and counts the ranks it discards
+        """
+        pair_counts = np.zeros((2, 13, 13))
+        deck = Deck()
+        for deal in range(num_deals):
+            dealer = deal % 2
+            deck.shuffle()
+            policy._hand = Hand(deck.cards[:6])
+            discards = sorted(card.rank - 1 for card in policy.select_discards(dealer, 0))
+            pair_counts[dealer, discards[0], discards[1]] += 1
+        return OpponentDiscardModel(pair_counts)
+
+    @staticmethod
+    def load(path : str) -> 'OpponentDiscardModel':
+        """
+        Loads a model saved with save
+        """
+        with np.load(path) as data:
+            return OpponentDiscardModel(data['pair_counts'], data['crib_table'])
+
+    @staticmethod
+    def load_or_build(path : str, policy : 'Player', num_deals : int=10_000) -> 'OpponentDiscardModel':
+        """
+        Loads the model at the given path, building and saving it there first if it doesn't exist
+        """
+        if os.path.exists(path):
+            return OpponentDiscardModel.load(path)
+        model = OpponentDiscardModel.build(policy, num_deals)
+        model.save(path)
+        return model
+
+    def save(self, path : str):
+        """
+        Saves the counts and the precomputed crib table
+        """
+        with open(path, 'wb') as f:
+            np.savez(f, pair_counts=self._pair_counts, crib_table=self._crib_table)
+
+    def probabilities(self, opponent_dealer : int, known_cards : list[Card]=None) -> np.ndarray:
+        """
+        Returns the probability of each rank pair r1 <= r2 being discarded by the opponent.
+        Given the cards the player knows, each pair is reweighted by how many ways it can still be made from the cards the player can't see.
+        """
+        counts = self._pair_counts[opponent_dealer]
+        if known_cards != None:
+            remaining = 4 - _rank_counts(known_cards)
+            ### Ways to make each pair from the unseen cards, relative to a full deck (16 for different ranks, 6 for a pair)
+            ways = np.outer(remaining, remaining).astype(np.float64)
+            np.fill_diagonal(ways, remaining * (remaining - 1) / 2)
+            full_ways = np.full((13, 13), 16.0)
+            np.fill_diagonal(full_ways, 6.0)
+            counts = counts * ways / full_ways
+        total = counts.sum()
+        if total == 0:
+            raise ValueError('No discards of the opponent are possible with the known cards.')
+        return counts / total
+
+    def sample(self, opponent_dealer : int, known_cards : list[Card], rng=random) -> list[Card]:
+        """
+        Samples two cards the opponent discards, from the cards not among the known cards
+        """
+        probabilities = self.probabilities(opponent_dealer, known_cards).ravel()
+        pair = rng.choices(range(len(probabilities)), weights=probabilities)[0]
+        ranks = (pair // 13 + 1, pair % 13 + 1)
+
+        unseen = unseen_cards(known_cards)
+        first = rng.choice([card for card in unseen if card.rank == ranks[0]])
+        second = rng.choice([card for card in unseen if card.rank == ranks[1] and card is not first])
+        return [first, second]
+
+    def _build_crib_table(self) -> np.ndarray:
+        """
+        For every rank pair the player could discard, precomputes the expected crib (without a starter) against the opponent's discards
+        """
+        crib_table = np.zeros((2, 13, 13))
+        rank_pair_scores = np.zeros((13, 13, 13, 13))
+        for r1 in range(13):
+            for r2 in range(r1, 13):
+                for o1 in range(13):
+                    for o2 in range(o1, 13):
+                        rank_pair_scores[r1, r2, o1, o2] = _rank_only_score([r1 + 1, r2 + 1, o1 + 1, o2 + 1])
+
+        for opponent_dealer in range(2):
+            probabilities = self.probabilities(opponent_dealer) if self._pair_counts[opponent_dealer].sum() > 0 else np.zeros((13, 13))
+            crib_table[opponent_dealer] = np.tensordot(rank_pair_scores, probabilities, axes=2)
+        return crib_table
+
+    def expected_crib(self, discards : list[Card], dealer : int=0, known_cards : list[Card]=None, starter : Card=None) -> float:
+        """
+        Returns the expected score of the crib holding the given discards, where dealer is whether the discarding player is dealing.
+        Without known cards or a starter this is a lookup in the precomputed table. Otherwise it's computed once from ranks and cached.
+        Flushes and nobs are not counted.
+        """
+        opponent_dealer = (dealer + 1) % 2
+        ranks = sorted(card.rank for card in discards)
+        if known_cards == None and starter is None:
+            return float(self._crib_table[opponent_dealer, ranks[0] - 1, ranks[1] - 1])
+
+        known_counts = tuple(_rank_counts(known_cards)) if known_cards != None else None
+        starter_rank = None if starter is None else starter.rank
+        key = (opponent_dealer, tuple(ranks), known_counts, starter_rank)
+        if key not in self._cache:
+            probabilities = self.probabilities(opponent_dealer, known_cards)
+            expected = 0.0
+            for o1, o2 in zip(*np.nonzero(probabilities)):
+                expected += probabilities[o1, o2] * _rank_only_score(ranks + [o1 + 1, o2 + 1], starter_rank)
+            self._cache[key] = expected
+        return self._cache[key]
@@ -1,22 +1,40 @@
-from src.scoring import Hand, PeggingPile
+from src.scoring import Hand, BitHand, PeggingPile, BitPeggingPile
 from src.player import RandomPlayer, Player
-from src.card import Deck
+from src.card import Card, Deck
+from src.game_log import GameRecorder, SCORE_HAND, SCORE_CRIB, NO_PLAYER
+from collections import namedtuple
 import random
 
 
+
+### The full state of a game as immutable bytes and ints. Hands and the crib are (card mask, starter index or -1) pairs,
+### the pegging pile is the card indexes in play and dead, in the order they were played
+GameSnapshot = namedtuple('GameSnapshot', ['deck', 'hands', 'crib', 'pegging', 'scores', 'dealer', 'turn'])
+
+
 class CribbageGame():
-    def __init__(self, player_one=RandomPlayer('AI 1'), player_two=RandomPlayer('AI 2'), winning_score : int=121):
+    def __init__(self, player_one=RandomPlayer('AI 1'), player_two=RandomPlayer('AI 2'), winning_score : int=121, recorder : GameRecorder=None,
+                 rng : random.Random=None):
         """
         Initializes the deck, players, crib, pegging pile, dealer and turn counters and target winning score of a cribbage game
+        If a recorder is given, every deal, discard, starter card and score is written to its game log.
+        If a random generator is given, the game and its players draw from it instead of the global one, see start_new_game.
         """
         self._deck = Deck()
         self._player_one = player_one
         self._player_two = player_two
-        self._crib = Hand()
-        self._pegging_pile = PeggingPile()
-        self._dealer = random.randint(0, 1)
+        self._crib = BitHand()
+        self._pegging_pile = BitPeggingPile()
+        ### None for the global generator, the random module itself can't be pickled or copied
+        self._generator = None
+        if rng != None:
+            self._use_rng(rng)
+        self._dealer = self._rng.randint(0, 1)
         self._turn = (self._dealer + 1) % 2
         self._winning_score = winning_score
+        self._recorder = recorder
+        self._recording_game = False
+        self._starter_recorded = False
 
     def __str__(self) -> str:
         """
@@ -101,11 +119,56 @@ class CribbageGame():
             return self.player_one
         return self.player_two
 
+    def snapshot(self) -> GameSnapshot:
+        """
+        Captures the deck, hands, crib, pegging pile, scores, dealer and turn, so search players can branch from this state
+        and come back to it with restore. Recording state and random generators aren't captured.
+        """
+        return GameSnapshot(self.deck.order, (self.player_one.hand_state, self.player_two.hand_state), self.crib.state,
+                            self.pegging_pile.state, (self.player_one.score, self.player_two.score), self._dealer, self._turn)
+
+    def restore(self, snapshot : GameSnapshot):
+        """
+        Puts the game back to a state captured by snapshot, reusing the existing deck, hands, crib and pegging pile
+        """
+        self.deck.restore_order(snapshot.deck)
+        for player, hand_state, score in zip((self.player_one, self.player_two), snapshot.hands, snapshot.scores):
+            player.restore_hand(hand_state)
+            player.clear_score()
+            player.score_points(score)
+        self.crib.restore(snapshot.crib)
+        self.pegging_pile.restore(snapshot.pegging)
+        self._dealer = snapshot.dealer
+        self._turn = snapshot.turn
+
+    def _player_index(self, player : Player) -> int:
+        """
+        Returns 0 for player one and 1 for player two
+        """
+        return 0 if player is self.player_one else 1
+
+    def _record_starter(self, include_top_card : bool):
+        """
+        Records the starter card the first time it is used in a round
+        """
+        if self._recorder != None and include_top_card and not self._starter_recorded:
+            self._recorder.starter(self.deck.cards[-1])
+            self._starter_recorded = True
+
+    def _record_score(self, player : Player, score_kind : int, points : int):
+        """
+        Records points scored by the given player
+        """
+        if self._recorder != None:
+            self._recorder.score(self._player_index(player), score_kind, points)
+
     def _score_hand(self, player : Player):
         """
         Scores points for the given player's hand
         """
+        score_before = player.score
         player.score_hand()
+        self._record_score(player, SCORE_HAND, player.score - score_before)
 
     def reset_game(self):
         """
@@ -115,7 +178,8 @@ class CribbageGame():
         self.deck.return_cards_to_deck(self.player_two.clear_hand())
         self.deck.return_cards_to_deck(self.crib.cards)
         self.deck.return_cards_to_deck(self.pegging_pile.end_pegging())
-        self.crib.discard(self.crib.cards.copy())
+        self.crib.clear()
+        self._starter_recorded = False
         self._turn = self._dealer
         self._dealer = (self._dealer + 1) % 2
         
@@ -126,22 +190,57 @@ class CribbageGame():
         self.deck.shuffle()
         self.deck.cut()
 
-    def start_new_game(self):
+    @property
+    def _rng(self):
+        """
+        Returns the random generator the game draws from, the global one unless another was given
+        """
+        return random if self._generator == None else self._generator
+
+    def _use_rng(self, rng : random.Random):
+        """
+        Makes the game, its deck and its players draw from the given random generator, starting from a new deck's order
+        """
+        self._generator = rng
+        self.deck.use_rng(rng)
+        self.deck.reset_order()
+        self.player_one.use_rng(rng)
+        self.player_two.use_rng(rng)
+
+    def start_new_game(self, rng : random.Random=None):
         """
-        For when you want to fully clear player scores and start a new game
+        For when you want to fully clear player scores and start a new game.
+        If a random generator is given, such as rng.game_rng(seed, game_index), the new game draws everything from it
+        and starts from a new deck's order, so the game only depends on the generator and can be replayed on its own.
         """
+        if self._recording_game:
+            winner = self.get_winner()
+            self._recorder.end_game(NO_PLAYER if winner == None else self._player_index(winner))
+            self._recording_game = False
+
         self.reset_game()
         self._player_one.clear_score()
         self._player_two.clear_score()
-        self._dealer = random.randint(0, 1)
+        if rng != None:
+            self._use_rng(rng)
+        self._dealer = self._rng.randint(0, 1)
         self._turn = (self._dealer + 1) % 2
 
     def deal_cards(self):
         """
         Deal cards to both players
         """
-        self.player_one.get_cards([self.deck.deal_card() for _ in range(6)])
-        self.player_two.get_cards([self.deck.deal_card() for _ in range(6)])
+        player_one_cards = [self.deck.deal_card() for _ in range(6)]
+        player_two_cards = [self.deck.deal_card() for _ in range(6)]
+        self.player_one.get_cards(player_one_cards)
+        self.player_two.get_cards(player_two_cards)
+
+        if self._recorder != None:
+            if not self._recording_game:
+                self._recorder.start_game(self._dealer)
+                self._recording_game = True
+            self._recorder.deal(0, player_one_cards)
+            self._recorder.deal(1, player_two_cards)
 
     def handle_discards(self):
         """
@@ -152,35 +251,48 @@ class CribbageGame():
         else:
             dealer = 0
         
-        self.crib.add_cards(
-            self.player_one.select_discards(dealer=dealer, opp_score=self.player_two.score) 
-            + self.player_two.select_discards(dealer=(dealer + 1) % 2, opp_score=self.player_one.score)
-        )
+        player_one_discards = self.player_one.select_discards(dealer=dealer, opp_score=self.player_two.score)
+        player_two_discards = self.player_two.select_discards(dealer=(dealer + 1) % 2, opp_score=self.player_one.score)
+        self.add_discards(player_one_discards, player_two_discards)
+
+    def add_discards(self, player_one_discards : list[Card], player_two_discards : list[Card]):
+        """
+        Puts discards the players already selected into the crib, for when discards are selected outside of handle_discards
+        """
+        self.crib.add_cards(player_one_discards + player_two_discards)
+
+        if self._recorder != None:
+            self._recorder.discard(0, player_one_discards)
+            self._recorder.discard(1, player_two_discards)
 
     def score_dealer(self, include_top_card=True):
         """
         Scores the dealer hand, including the top card. Can exclude the top card by setting include_top_card to false.
         """
         ### If top card included, add it to the player's hand
+        self._record_starter(include_top_card)
         if include_top_card:
             self.dealer.get_cards([self.deck.cards[-1]])
 
         ### Score the hand, then remove the top card from the player's hand.
         self._score_hand(self.dealer)
 
-        if self.deck.cards[-1] in self.dealer.hand.cards:
+        if self.dealer.hand.contains(self.deck.cards[-1]):
             self.dealer.hand.discard([self.deck.cards[-1]])
 
     def score_crib(self, include_top_card=True):
         """
         Scores the crib and gives those points to the dealer. Can exclude top card by changing it to False.
         """
+        self._record_starter(include_top_card)
         if include_top_card:
             self.crib.add_cards([self.deck.cards[-1]])
         
-        self.dealer.score_points(self.crib.score)
+        crib_score = self.crib.score
+        self.dealer.score_points(crib_score)
+        self._record_score(self.dealer, SCORE_CRIB, crib_score)
 
-        if self.deck.cards[-1] in self.crib.cards:
+        if self.crib.contains(self.deck.cards[-1]):
             self.crib.discard([self.deck.cards[-1]])
 
     def score_non_dealer(self, include_top_card=True):
@@ -188,12 +300,13 @@ class CribbageGame():
         Scores the non dealer hand, including the top card. Can exclude the top card by setting include_top_card to false.
         """
         ### If top card included, add it to the player's hand
+        self._record_starter(include_top_card)
         if include_top_card:
             self.non_dealer.get_cards([self.deck.cards[-1]])
 
         ### Score the hand, then remove the top card from the player's hand.
         self._score_hand(self.non_dealer)
-        if self.deck.cards[-1] in self.non_dealer.hand.cards:
+        if self.non_dealer.hand.contains(self.deck.cards[-1]):
             self.non_dealer.hand.discard([self.deck.cards[-1]])
 
     def get_winner(self) -> Player:
@@ -0,0 +1,92 @@
+from src.card import Card, Deck
+from src.scoring import Hand, score_hands
+import itertools
+import random
+import numpy as np
+
+
+
+### Every way of discarding two cards out of six, in the same order as the discard network's outputs
+DISCARD_OPTIONS = list(itertools.combinations(range(6), 2))
+### For each discard option, the positions of the four kept cards and the two discards among six sorted cards
+KEPT_POSITIONS = np.array([[i for i in range(6) if i not in option] for option in DISCARD_OPTIONS])
+DISCARD_POSITIONS = np.array(DISCARD_OPTIONS)
+
+
+### Every card of a deck in index order, shared by every call rather than built again each time
+_DECK_CARDS = tuple(Deck().cards)
+
+
+def unseen_cards(known_cards : list[Card]) -> list[Card]:
+    """
+    Returns every card of the deck that isn't among the known cards, comparing both face and suit
+    """
+    known_indexes = set(card.index for card in known_cards)
+    return [card for card in _DECK_CARDS if card.index not in known_indexes]
+
+
+def split_discards(cards : list[Card], option : int) -> tuple[list[Card], list[Card]]:
+    """
+    Splits six cards into the four kept cards and the two discards of the given discard option
+    """
+    discard_indexes = DISCARD_OPTIONS[option]
+    kept = [card for i, card in enumerate(cards) if i not in discard_indexes]
+    discards = [cards[i] for i in discard_indexes]
+    return kept, discards
+
+
+def score_discard_options(cards : list[Card], adversary_discards : list[Card], starter : Card=None, dealer : int=0) -> list[int]:
+    """
+    Scores all 15 discard options of six cards against the same adversary discards and starter card, as one batch of hands and cribs.
+    Each score is the kept hand's score plus the crib's score when dealing, or minus it when not dealing.
+    """
+    indexes = np.array([card.index for card in cards])
+    options = len(DISCARD_OPTIONS)
+    starter_column = np.full((options, 0 if starter is None else 1), 0 if starter is None else starter.index)
+    adversary = np.tile([card.index for card in adversary_discards], (options, 1))
+
+    hand_scores = score_hands(np.concatenate([indexes[KEPT_POSITIONS], starter_column], axis=1))
+    crib_scores = score_hands(np.concatenate([indexes[DISCARD_POSITIONS], adversary, starter_column], axis=1))
+    return (hand_scores + (crib_scores if dealer else -crib_scores)).tolist()
+
+
+def naive_option(cards : list[Card]) -> int:
+    """
+    Returns the discard option a naive player picks for six sorted cards, the one keeping the highest scoring hand (the last one on ties)
+    """
+    indexes = np.array([card.index for card in cards])
+    kept_scores = score_hands(indexes[KEPT_POSITIONS])
+    return len(DISCARD_OPTIONS) - 1 - int(np.argmax(kept_scores[::-1]))
+
+
+def _deal_adversary(cards : list[Card], rng=random) -> tuple[list[Card], Card, int]:
+    """
+    Deals a naive adversary hand and a starter card from the cards not among the six sorted cards.
+    Returns the adversary's discards, the starter card and the adversary's hand score.
+    """
+    adversary_cards = sorted(rng.sample(unseen_cards(cards), 6))
+    adversary_kept, adversary_discards = split_discards(adversary_cards, naive_option(adversary_cards))
+    starter = rng.choice(unseen_cards(cards + adversary_cards))
+    return adversary_discards, starter, Hand(adversary_kept + [starter]).score
+
+
+def sample_discard_targets(cards : list[Card], rng=random) -> tuple[int, list[int]]:
+    """
+    Deals a naive adversary hand and a starter card from the cards not among the six sorted cards, then scores all 15 discards against them.
+    Returns the randomly drawn dealer flag and the score of each discard option minus the adversary's hand score.
+    """
+    dealer = rng.randrange(0, 2)
+    adversary_discards, starter, adversary_score = _deal_adversary(cards, rng)
+
+    ### Every discard is scored against the same adversary discards and starter, so each target is a real outcome
+    return dealer, [score - adversary_score for score in score_discard_options(cards, adversary_discards, starter, dealer)]
+
+
+def sample_discard_target(cards : list[Card], option : int, dealer : int, rng=random) -> int:
+    """
+    Deals a naive adversary hand and a starter card like sample_discard_targets, but only scores the given discard option
+    """
+    adversary_discards, starter, adversary_score = _deal_adversary(cards, rng)
+    kept, discards = split_discards(cards, option)
+    crib_score = Hand(discards + adversary_discards + [starter]).score
+    return Hand(kept + [starter]).score + (crib_score if dealer else -crib_score) - adversary_score
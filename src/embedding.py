@@ -0,0 +1,58 @@
+from src.encoding import HAND_SIZE, SLOT_SIZE, COMPACT_INPUT_SIZE
+import numpy as np
+import tensorflow as tf
+
+
+
+class CardSlotEmbedding(tf.keras.layers.Layer):
+    """
+    The first layer of the discard network for compact inputs of six card ids followed by the scalar features.
+    Each card slot has its own embedding of the card ids, and the slot embeddings are summed with a dense projection of the scalars.
+    A one hot input times a dense kernel picks out one row of the kernel per slot, so this computes the same thing as the
+    first dense layer of the one hot network when given the rows of its kernel.
+    """
+    def __init__(self, units : int, activation : str=None, **kwargs):
+        super().__init__(**kwargs)
+        self._units = units
+        self._activation_name = activation
+        self._activation = tf.keras.activations.get(activation)
+        ### Slot i's ids index rows i * SLOT_SIZE onwards of the embeddings
+        self._offsets = tf.constant(np.arange(HAND_SIZE) * SLOT_SIZE, dtype=tf.int32)
+
+    def build(self, input_shape):
+        self.embeddings = self.add_weight(name='embeddings', shape=(HAND_SIZE * SLOT_SIZE, self._units), initializer='glorot_uniform')
+        self.kernel = self.add_weight(name='kernel', shape=(COMPACT_INPUT_SIZE - HAND_SIZE, self._units), initializer='glorot_uniform')
+        self.bias = self.add_weight(name='bias', shape=(self._units,), initializer='zeros')
+        super().build(input_shape)
+
+    def call(self, inputs : tf.Tensor) -> tf.Tensor:
+        ids = tf.cast(inputs[:, :HAND_SIZE], tf.int32) + self._offsets
+        slots = tf.reduce_sum(tf.gather(self.embeddings, ids), axis=1)
+        return self._activation(slots + tf.matmul(inputs[:, HAND_SIZE:], self.kernel) + self.bias)
+
+    def get_config(self) -> dict:
+        config = super().get_config()
+        config.update({'units': self._units, 'activation': self._activation_name})
+        return config
+
+
+def create_compact_discard_network(layer_widths : tuple[int]) -> tf.keras.Model:
+    """
+    Creates an uncompiled discard network taking compact inputs, with the same layers as the one hot network of the given widths
+    """
+    inputs = tf.keras.layers.Input((COMPACT_INPUT_SIZE,))
+    hidden = CardSlotEmbedding(layer_widths[0], activation='relu')(inputs)
+    for width in layer_widths[1:]:
+        hidden = tf.keras.layers.Dense(width, activation='relu')(hidden)
+    outputs = tf.keras.layers.Dense(15, activation='linear')(hidden)
+    return tf.keras.Model(inputs=inputs, outputs=outputs, name='crib_discard_model_compact')
+
+
+def compact_weights(one_hot_weights : list[np.ndarray]) -> list[np.ndarray]:
+    """
+    Converts the weights of a one hot discard network into the weights of the compact network with the same widths,
+    by splitting the first kernel into the rows for the card slots and the rows for the scalar features
+    """
+    first_kernel, first_bias = one_hot_weights[:2]
+    slot_rows = HAND_SIZE * SLOT_SIZE
+    return [first_kernel[:slot_rows], first_kernel[slot_rows:], first_bias] + list(one_hot_weights[2:])
@@ -0,0 +1,62 @@
+from src.card import Card
+import numpy as np
+
+
+
+### Each card slot is one hot over the 52 cards plus the lookup's out of vocabulary index 0
+SLOT_SIZE = 53
+HAND_SIZE = 6
+INPUT_SIZE = HAND_SIZE * SLOT_SIZE + 3
+### The compact input is the six card ids themselves followed by the same three scalars
+COMPACT_INPUT_SIZE = HAND_SIZE + 3
+
+
+def card_ids(cards : list[Card]) -> list[int]:
+    """
+    Returns the ids of the cards in sorted order, as the network's card lookup numbers them (card index + 1)
+    """
+    return [card.index + 1 for card in sorted(cards)]
+
+
+def encode_discard_inputs(hand_ids : np.ndarray, dealer : np.ndarray, score : np.ndarray, opp_score : np.ndarray) -> np.ndarray:
+    """
+    Encodes a batch of hands into discard network inputs with numpy, the same as NetworkPlayer._convert_hand_to_input.
+    hand_ids holds each hand's six sorted card ids, the rest hold one value per hand.
+    """
+    hand_ids = np.asarray(hand_ids, dtype=np.int64)
+    count = len(hand_ids)
+    inputs = np.zeros((count, INPUT_SIZE), dtype=np.float32)
+    rows = np.repeat(np.arange(count), HAND_SIZE)
+    columns = (np.arange(HAND_SIZE) * SLOT_SIZE + hand_ids).ravel()
+    inputs[rows, columns] = 1.0
+    inputs[:, -3] = dealer
+    inputs[:, -2] = np.asarray(score, dtype=np.float32) / 121.0
+    inputs[:, -1] = np.asarray(opp_score, dtype=np.float32) / 121.0
+    return inputs
+
+
+def encode_discard_input(cards : list[Card], dealer : int, score : int=0, opp_score : int=0) -> np.ndarray:
+    """
+    Encodes a single hand into a discard network input with numpy
+    """
+    return encode_discard_inputs([card_ids(cards)], [dealer], [score], [opp_score])[0]
+
+
+def encode_compact_inputs(hand_ids : np.ndarray, dealer : np.ndarray, score : np.ndarray, opp_score : np.ndarray) -> np.ndarray:
+    """
+    Encodes a batch of hands into compact discard network inputs, each hand's six sorted card ids followed by the scalars
+    """
+    hand_ids = np.asarray(hand_ids, dtype=np.float32)
+    inputs = np.zeros((len(hand_ids), COMPACT_INPUT_SIZE), dtype=np.float32)
+    inputs[:, :HAND_SIZE] = hand_ids
+    inputs[:, -3] = dealer
+    inputs[:, -2] = np.asarray(score, dtype=np.float32) / 121.0
+    inputs[:, -1] = np.asarray(opp_score, dtype=np.float32) / 121.0
+    return inputs
+
+
+def encode_compact_input(cards : list[Card], dealer : int, score : int=0, opp_score : int=0) -> np.ndarray:
+    """
+    Encodes a single hand into a compact discard network input
+    """
+    return encode_compact_inputs([card_ids(cards)], [dealer], [score], [opp_score])[0]
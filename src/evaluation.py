@@ -0,0 +1,278 @@
+from src.card import Card
+from src.discards import DISCARD_OPTIONS, KEPT_POSITIONS, DISCARD_POSITIONS
+from src.scoring import score_hands
+from src.encoding import encode_discard_inputs, encode_compact_inputs, COMPACT_INPUT_SIZE
+from src.embedding import CardSlotEmbedding
+from collections import namedtuple
+import glob
+import json
+import os
+import re
+import shutil
+import numpy as np
+import tensorflow as tf
+
+
+
+### Everything random about a discard decision, one row per scenario: the six sorted card indexes being discarded from,
+### the dealer flag, the naive adversary's six sorted card indexes and the starter card's index
+DiscardScenarios = namedtuple('DiscardScenarios', ['cards', 'dealer', 'adversary', 'starter'])
+
+
+def naive_options(cards : np.ndarray) -> np.ndarray:
+    """
+    Returns the discard option a naive player picks for each row of six sorted card indexes, like discards.naive_option
+    """
+    kept_scores = np.stack([score_hands(cards[:, kept]) for kept in KEPT_POSITIONS], axis=1)
+    ### The last of the highest scores, as the naive player keeps the later option on ties
+    return len(DISCARD_OPTIONS) - 1 - np.argmax(kept_scores[:, ::-1], axis=1)
+
+
+def deal_scenarios(cards : np.ndarray, rng : np.random.Generator, chunk_size : int=65_536) -> DiscardScenarios:
+    """
+    For each row of six sorted card indexes, draws the dealer flag and deals the adversary's six cards and a starter card from the other 46 cards.
+    Rows are dealt chunk_size at a time, which bounds the memory of the random keys each deal is drawn with.
+    """
+    count = len(cards)
+    dealer = rng.integers(0, 2, count)
+    adversary = np.empty((count, 6), dtype=np.int64)
+    starter = np.empty(count, dtype=np.int64)
+
+    for start in range(0, count, chunk_size):
+        chunk = cards[start:start + chunk_size]
+        rows = np.arange(len(chunk))[:, None]
+        ### The seven lowest random keys among the cards not held are the adversary's six cards and the starter
+        keys = rng.random((len(chunk), 52))
+        keys[rows, chunk] = 2.0
+        dealt = np.argpartition(keys, 6, axis=1)[:, :7]
+        adversary[start:start + len(chunk)] = np.sort(dealt[:, :6], axis=1)
+        starter[start:start + len(chunk)] = dealt[:, 6]
+    return DiscardScenarios(cards, dealer, adversary, starter)
+
+
+def draw_scenarios(hands : list[list[Card]], num_scenarios : int, seed=None) -> DiscardScenarios:
+    """
+    Draws num_scenarios scenarios from the given hands, to be shared by every policy being compared.
+    The seed can be anything np.random.default_rng takes.
+    """
+    rng = np.random.default_rng(seed)
+    hand_indexes = np.sort(np.array([[card.index for card in hand] for hand in hands], dtype=np.int64), axis=1)
+    return deal_scenarios(hand_indexes[rng.integers(0, len(hand_indexes), num_scenarios)], rng)
+
+
+def save_scenarios(path : str, scenarios : DiscardScenarios):
+    """
+    Saves scenarios so later evaluations can reuse exactly the same ones
+    """
+    with open(path, 'wb') as f:
+        np.savez(f, **scenarios._asdict())
+
+
+def load_scenarios(path : str) -> DiscardScenarios:
+    """
+    Loads scenarios saved with save_scenarios
+    """
+    with np.load(path) as data:
+        return DiscardScenarios(*(data[field] for field in DiscardScenarios._fields))
+
+
+def _slice_scenarios(scenarios : DiscardScenarios, start : int, stop : int) -> DiscardScenarios:
+    return DiscardScenarios(*(values[start:stop] for values in scenarios))
+
+
+def scenario_outcomes(scenarios : DiscardScenarios) -> np.ndarray:
+    """
+    Scores all 15 discards of every scenario against its naive adversary and starter, the same as discards.sample_discard_targets.
+    Returns the (scenarios, 15) scores.
+    """
+    cards = scenarios.cards
+    rows = np.arange(len(cards))[:, None]
+    starter = scenarios.starter[:, None]
+
+    adversary = scenarios.adversary
+    adversary_option = naive_options(adversary)
+    adversary_kept = adversary[rows, KEPT_POSITIONS[adversary_option]]
+    adversary_discards = adversary[rows, DISCARD_POSITIONS[adversary_option]]
+    adversary_score = score_hands(np.concatenate([adversary_kept, starter], axis=1))
+
+    crib_sign = np.where(scenarios.dealer == 1, 1, -1)
+    outcomes = np.empty((len(cards), len(DISCARD_OPTIONS)), dtype=np.int64)
+    for option, (kept, discarded) in enumerate(zip(KEPT_POSITIONS, DISCARD_POSITIONS)):
+        hand_score = score_hands(np.concatenate([cards[:, kept], starter], axis=1))
+        crib_score = score_hands(np.concatenate([cards[:, discarded], adversary_discards, starter], axis=1))
+        outcomes[:, option] = hand_score + crib_sign * crib_score - adversary_score
+    return outcomes
+
+
+def deal_discard_outcomes(cards : np.ndarray, rng : np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """
+    For each row of six sorted card indexes, deals a scenario and scores all 15 discards in it.
+    Returns the dealer flags and the (rows, 15) scores.
+    """
+    scenarios = deal_scenarios(cards, rng)
+    return scenarios.dealer, scenario_outcomes(scenarios)
+
+
+def network_policy(model, compact : bool=False):
+    """
+    Returns a policy discarding with the network's highest output, running each chunk of scenarios through it in one batch
+    """
+    def policy(scenarios : DiscardScenarios) -> np.ndarray:
+        zeros = np.zeros(len(scenarios.cards))
+        encode = encode_compact_inputs if compact else encode_discard_inputs
+        outputs = np.asarray(model(encode(scenarios.cards + 1, scenarios.dealer, zeros, zeros), training=False))
+        return np.argmax(outputs, axis=1)
+    return policy
+
+
+def batched_network_policies(models : dict) -> dict:
+    """
+    Returns a policy for each of the named models, all sharing one run per chunk of scenarios. The chunk is encoded once for
+    each input format and every model runs on it in the same graph, where tensorflow can run the models in parallel.
+    """
+    names = list(models)
+    compact = [models[name].input_shape[-1] == COMPACT_INPUT_SIZE for name in names]
+
+    @tf.function(reduce_retracing=True)
+    def choose(one_hot_inputs : tf.Tensor, compact_inputs : tf.Tensor) -> tf.Tensor:
+        outputs = [models[name](compact_inputs if is_compact else one_hot_inputs, training=False) for name, is_compact in zip(names, compact)]
+        return tf.argmax(tf.stack(outputs), axis=2)
+
+    ### compare_policies calls every policy on the same chunk in turn, so only the first call of each chunk runs the models
+    last = {'cards': None, 'choices': None}
+    def run(scenarios : DiscardScenarios) -> np.ndarray:
+        if last['cards'] is not scenarios.cards:
+            zeros = np.zeros(len(scenarios.cards))
+            ### A format no model takes is left as a placeholder column rather than encoded
+            one_hot_inputs = encode_discard_inputs(scenarios.cards + 1, scenarios.dealer, zeros, zeros) if not all(compact) else zeros[:, None]
+            compact_inputs = encode_compact_inputs(scenarios.cards + 1, scenarios.dealer, zeros, zeros) if any(compact) else zeros[:, None]
+            last['cards'] = scenarios.cards
+            last['choices'] = choose(tf.constant(one_hot_inputs, tf.float32), tf.constant(compact_inputs, tf.float32)).numpy()
+        return last['choices']
+
+    return {name: (lambda scenarios, i=i: run(scenarios)[i]) for i, name in enumerate(names)}
+
+
+def naive_policy(scenarios : DiscardScenarios) -> np.ndarray:
+    """
+    Discards like the naive player, keeping the highest scoring four cards
+    """
+    return naive_options(scenarios.cards)
+
+
+def random_policy(seed=None):
+    """
+    Returns a policy discarding uniformly at random. The seed can be anything np.random.default_rng takes.
+    """
+    rng = np.random.default_rng(seed)
+    return lambda scenarios: rng.integers(0, len(DISCARD_OPTIONS), len(scenarios.cards))
+
+
+def _summary(scores : np.ndarray, best : np.ndarray) -> dict:
+    """
+    Returns the mean score with its 95% confidence interval, and the regret against the best discard in hindsight
+    """
+    regret = best - scores
+    half_width = 1.96 * scores.std(ddof=1) / np.sqrt(len(scores))
+    return {'mean': float(scores.mean()), 'ci95': [float(scores.mean() - half_width), float(scores.mean() + half_width)],
+            'std': float(scores.std(ddof=1)), 'regret': float(regret.mean()), 'best_rate': float((regret == 0).mean())}
+
+
+def _chosen_outcomes(policies : dict, scenarios : DiscardScenarios, chunk_size : int) -> tuple[dict, np.ndarray]:
+    """
+    Runs every policy on the scenarios a chunk at a time, returning each policy's outcomes and the best outcome of every scenario
+    """
+    chosen = {name: [] for name in policies}
+    best = []
+    for start in range(0, len(scenarios.cards), chunk_size):
+        chunk = _slice_scenarios(scenarios, start, start + chunk_size)
+        outcomes = scenario_outcomes(chunk)
+        rows = np.arange(len(outcomes))
+        for name, policy in policies.items():
+            chosen[name].append(outcomes[rows, policy(chunk)])
+        best.append(outcomes.max(axis=1))
+    return {name: np.concatenate(scores) for name, scores in chosen.items()}, np.concatenate(best)
+
+
+def _paired_difference(scores : np.ndarray, baseline_scores : np.ndarray) -> dict:
+    """
+    Returns the mean difference of two policies' scores on the same scenarios with its standard error and 95% confidence interval,
+    along with the standard error the difference would have had with independent scenarios for each policy
+    """
+    differences = scores - baseline_scores
+    mean = differences.mean()
+    standard_error = differences.std(ddof=1) / np.sqrt(len(differences))
+    independent_error = np.sqrt((scores.var(ddof=1) + baseline_scores.var(ddof=1)) / len(differences))
+    return {'mean': float(mean), 'standard_error': float(standard_error),
+            'ci95': [float(mean - 1.96 * standard_error), float(mean + 1.96 * standard_error)],
+            'independent_standard_error': float(independent_error),
+            ### How many times more scenarios independent sampling would need for the same standard error
+            'sample_savings': float((independent_error / standard_error) ** 2) if standard_error > 0 else float('inf')}
+
+
+def compare_policies(policies : dict, scenarios : DiscardScenarios, baseline : str=None, chunk_size : int=65_536, output_path : str=None) -> dict:
+    """
+    Scores every policy against exactly the same scenarios, so their differences are paired and only vary with the
+    policies' decisions rather than with the deals. Policies map names to functions taking a chunk of scenarios and returning
+    the discard option chosen in each. Every policy is compared to the baseline one (the first by default).
+    Returns each policy's summary and paired difference, also written to the output path as json if one is given.
+    """
+    baseline = list(policies)[0] if baseline == None else baseline
+    chosen, best = _chosen_outcomes(policies, scenarios, chunk_size)
+
+    report = {'num_scenarios': len(best), 'baseline': baseline, 'best': {'mean': float(best.mean())}}
+    for name, scores in chosen.items():
+        report[name] = _summary(scores, best)
+        if name != baseline:
+            report[name]['vs_' + baseline] = _paired_difference(scores, chosen[baseline])
+
+    if output_path != None:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def evaluate_discards(model, hands : list[list[Card]], num_hands : int=1_000_000, chunk_size : int=65_536, seed : int=None,
+                      output_path : str=None) -> dict:
+    """
+    Evaluates the discard network against the naive and random discard policies on num_hands scenarios drawn from the given hands.
+    Each chunk of scenarios is encoded at once, run through the model in one batch, and every policy's discards are scored
+    against the same adversary and starter card with vectorized scoring. Returns the summary of each policy, also written
+    to the output path as json if one is given.
+    """
+    ### Independent streams of the seed, so the random policy's choices aren't correlated with the scenarios
+    scenario_seed, policy_seed = np.random.SeedSequence(seed).spawn(2)
+    policies = {'naive': naive_policy, 'network': network_policy(model), 'random': random_policy(policy_seed)}
+    return compare_policies(policies, draw_scenarios(hands, num_hands, scenario_seed), 'naive', chunk_size, output_path)
+
+
+def checkpoint_paths(directory : str, prefix : str='network') -> list[str]:
+    """
+    Returns the paths of the checkpoints in the directory, in order of their step
+    """
+    ### Only the prefix followed by a step is a checkpoint, other models such as the best one may share the directory
+    pattern = re.compile(re.escape(prefix) + r'(\d+)\.h5')
+    steps = {path: pattern.fullmatch(os.path.basename(path)) for path in glob.glob(os.path.join(directory, f'{prefix}*.h5'))}
+    return sorted((path for path, match in steps.items() if match != None), key=lambda path: int(steps[path].group(1)))
+
+
+def select_best_checkpoint(paths : list[str], scenarios : DiscardScenarios, best_path : str='test_network_best.h5', chunk_size : int=65_536,
+                           output_path : str=None) -> dict:
+    """
+    Loads every checkpoint once and scores them all on the same scenarios in one pass, ranking them by their mean
+    difference to the naive policy. The highest ranked checkpoint is copied to the best path. Returns the comparison
+    with the ranking under 'ranking', also written to the output path as json if one is given.
+    """
+    models = {path: tf.keras.models.load_model(path, custom_objects={'CardSlotEmbedding': CardSlotEmbedding}, compile=False) for path in paths}
+    policies = {'naive': naive_policy}
+    policies.update(batched_network_policies(models))
+
+    report = compare_policies(policies, scenarios, 'naive', chunk_size)
+    report['ranking'] = sorted(paths, key=lambda path: report[path]['vs_naive']['mean'], reverse=True)
+    shutil.copyfile(report['ranking'][0], best_path)
+    report['selected'] = best_path
+
+    if output_path != None:
+        with open(output_path, 'w') as f:
+            json.dump(report, f, indent=2)
+    return report
@@ -0,0 +1,157 @@
+from collections import namedtuple
+from src.card import Card
+import mmap
+import os
+import struct
+import numpy as np
+
+
+
+### Record types
+GAME_START = 1
+DEAL = 2
+DISCARD = 3
+STARTER = 4
+SCORE = 5
+GAME_END = 6
+
+### What a score record was scored for
+SCORE_HAND = 0
+SCORE_CRIB = 1
+SCORE_PEGGING = 2
+
+### Used as the player of records that don't belong to a player
+NO_PLAYER = 255
+
+_MAGIC = b'CRIBLOG1'
+### Every record is the same size: type, player, score kind, card count, points, then up to 6 card indexes
+_RECORD = struct.Struct('<BBBBH6s')
+
+GameRecord = namedtuple('GameRecord', ['type', 'player', 'score_kind', 'points', 'cards'])
+
+
+
+class GameRecorder():
+    """
+    Writes games to an append only binary log of fixed size records, with an index file holding where each game starts.
+    Writes are buffered and only flushed every flush_every games, so recording costs little more than building the records.
+    """
+    def __init__(self, path : str, flush_every : int=1_000, buffer_size : int=1 << 20):
+        self._path = path
+        self._flush_every = flush_every
+        new_log = not os.path.exists(path) or os.path.getsize(path) == 0
+
+        self._log = open(path, 'ab', buffering=buffer_size)
+        self._index = open(path + '.idx', 'ab', buffering=buffer_size)
+        if new_log:
+            self._log.write(_MAGIC)
+        self._offset = os.path.getsize(path) if not new_log else len(_MAGIC)
+        self._games_since_flush = 0
+
+    def _write(self, record_type : int, player : int=NO_PLAYER, cards : list[Card]=None, score_kind : int=0, points : int=0):
+        """
+        Packs a single record and appends it to the log
+        """
+        cards = [] if cards == None else cards
+        self._log.write(_RECORD.pack(record_type, player, score_kind, len(cards), points, bytes(card.index for card in cards)))
+        self._offset += _RECORD.size
+
+    def start_game(self, dealer : int):
+        """
+        Starts a new game in the log, recording its starting dealer
+        """
+        self._index.write(struct.pack('<q', self._offset))
+        self._write(GAME_START, dealer)
+
+    def deal(self, player : int, cards : list[Card]):
+        """
+        Records the cards dealt to a player
+        """
+        self._write(DEAL, player, cards)
+
+    def discard(self, player : int, cards : list[Card]):
+        """
+        Records the cards a player put in the crib
+        """
+        self._write(DISCARD, player, cards)
+
+    def starter(self, card : Card):
+        """
+        Records the starter card
+        """
+        self._write(STARTER, cards=[card])
+
+    def score(self, player : int, score_kind : int, points : int):
+        """
+        Records points scored by a player
+        """
+        self._write(SCORE, player, score_kind=score_kind, points=points)
+
+    def end_game(self, winner : int):
+        """
+        Ends the current game, recording its winner, and flushes if enough games were recorded since the last flush
+        """
+        self._write(GAME_END, winner)
+        self._games_since_flush += 1
+        if self._games_since_flush >= self._flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Pushes everything buffered to disk
+        """
+        self._log.flush()
+        self._index.flush()
+        self._games_since_flush = 0
+
+    def close(self):
+        """
+        Flushes and closes the log and index files
+        """
+        self.flush()
+        self._log.close()
+        self._index.close()
+
+
+
+class GameLogReader():
+    """
+    Reads a game log through a memory map, using its index to seek straight to any game.
+    """
+    def __init__(self, path : str):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(_MAGIC)] != _MAGIC:
+            raise ValueError(path + ' is not a game log.')
+        self._starts = np.fromfile(path + '.idx', dtype='<i8')
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self):
+        for game in range(len(self)):
+            yield from self.game(game)
+
+    def _read(self, offset : int) -> GameRecord:
+        """
+        Unpacks the record at the given byte offset
+        """
+        record_type, player, score_kind, count, points, card_bytes = _RECORD.unpack_from(self._map, offset)
+        cards = [Card.from_index(index) for index in card_bytes[:count]]
+        return GameRecord(record_type, player, score_kind, points, cards)
+
+    def game(self, game : int):
+        """
+        Generates the records of the given game, in the order they were written
+        """
+        start = int(self._starts[game])
+        end = int(self._starts[game + 1]) if game + 1 < len(self) else len(self._map)
+        for offset in range(start, end - _RECORD.size + 1, _RECORD.size):
+            yield self._read(offset)
+
+    def close(self):
+        """
+        Unmaps and closes the log
+        """
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,300 @@
+from abc import ABCMeta, abstractmethod
+from concurrent.futures import Executor, ThreadPoolExecutor
+from src.cribbage_game import CribbageGame
+from src.player import Player, RandomPlayer, NaivePlayer, NetworkPlayer, HumanPlayer
+from src.card import Card
+from src.inference import DiscardInferenceService
+import asyncio
+import functools
+import itertools
+import os
+
+
+
+### The kinds of bots a table can be seated with
+BOT_TYPES = {
+    'random': RandomPlayer,
+    'naive': NaivePlayer,
+    'network': NetworkPlayer,
+}
+
+
+def create_bot(bot_type : str, name : str, network_model : str=None, inference_service : DiscardInferenceService=None) -> Player:
+    """
+    Creates a bot of the given type. Network players predict through the inference service if one is given,
+    otherwise the network model is loaded into them if one is given.
+    """
+    if bot_type not in BOT_TYPES:
+        raise ValueError(bot_type + ' is not a bot type, pick one of ' + ', '.join(BOT_TYPES) + '.')
+    if bot_type == 'network' and inference_service != None:
+        ### Every bot's predictions go through the service's model, so they don't need models of their own
+        return NetworkPlayer(name, inference_service, build_network=False)
+    bot = BOT_TYPES[bot_type](name)
+    if bot_type == 'network' and network_model != None:
+        bot.load_discard_model(network_model)
+    return bot
+
+
+
+class Seat(metaclass=ABCMeta):
+    """Abstract Base Class for a seat at a table, which makes a player's decisions without blocking the event loop"""
+    def __init__(self, player : Player):
+        self._player = player
+
+    @property
+    def player(self) -> Player:
+        return self._player
+
+    @abstractmethod
+    async def select_discards(self, dealer : int=0, opp_score : int=0) -> list[Card]:
+        """
+        Select cards to place in the crib
+        """
+        pass
+
+    async def notify(self, message : str):
+        """
+        Tells whoever is in the seat what happened, only humans need to be told
+        """
+        pass
+
+
+
+class BotSeat(Seat):
+    """
+    A seat for a bot, whose decisions are made on an executor so CPU heavy bots don't stall the other tables.
+    """
+    def __init__(self, player : Player, executor : Executor=None):
+        super().__init__(player)
+        self._executor = executor
+
+    async def select_discards(self, dealer : int=0, opp_score : int=0) -> list[Card]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(self.player.select_discards, dealer=dealer, opp_score=opp_score))
+
+
+
+class HumanSeat(Seat):
+    """
+    A seat for a human connected through a socket, who is sent their cards and answers with the numbers of the cards they pick.
+    """
+    def __init__(self, player : Player, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        super().__init__(player)
+        self._reader = reader
+        self._writer = writer
+
+    async def notify(self, message : str):
+        self._writer.write((message + '\n').encode())
+        await self._writer.drain()
+
+    async def _present_cards_for_selection(self, num_cards : int=1, dealer : int=0) -> list[Card]:
+        """
+        Text representation of the hand sent to the human, who answers with the cards to play/discard
+        """
+        selected_cards = []
+        while len(selected_cards) != num_cards:
+            selected_cards = []
+            s = ''
+            for i, card in enumerate(self.player.hand.cards):
+                s += '(' + str(i + 1) + ') ' + str(card) + '\n'
+
+            if dealer == 1:
+                await self.notify('Here are your cards, you are the dealer:\n' + s)
+            else:
+                await self.notify('Here are your cards, you are not the dealer:\n' + s)
+            await self.notify('Select ' + str(num_cards) + ' cards: ')
+
+            selection = await self._reader.readline()
+            if selection == b'':
+                raise ConnectionError(self.player.name + ' disconnected.')
+            card_indexes = [int(s) for s in selection.decode().split() if s.isdigit()]
+            ### The whole selection is checked before anything is taken from the hand, so a bad one can just be asked for again
+            invalid_indexes = [i for i in card_indexes if i < 1 or i > len(self.player.hand.cards)]
+            if len(invalid_indexes) > 0:
+                for i in invalid_indexes:
+                    await self.notify(str(i) + ' is an invalid selection.')
+                continue
+            if len(set(card_indexes)) != len(card_indexes):
+                await self.notify('Each card can only be selected once.')
+                continue
+            selected_cards = [self.player.hand.cards[i-1] for i in card_indexes]
+
+        self.player.hand.discard(selected_cards)
+        return selected_cards
+
+    async def select_discards(self, dealer : int=0, opp_score : int=0) -> list[Card]:
+        return await self._present_cards_for_selection(2, dealer=dealer)
+
+
+
+class Table():
+    """
+    A single cribbage game between two seats, played as a coroutine so many tables can share one event loop.
+    """
+    def __init__(self, table_id : int, seat_one : Seat, seat_two : Seat, winning_score : int=121):
+        self._table_id = table_id
+        self._seat_one = seat_one
+        self._seat_two = seat_two
+        self._game = CribbageGame(seat_one.player, seat_two.player, winning_score)
+
+    @property
+    def table_id(self) -> int:
+        return self._table_id
+
+    @property
+    def game(self) -> CribbageGame:
+        return self._game
+
+    async def _notify_all(self, message : str):
+        """
+        Tells both seats what happened
+        """
+        await asyncio.gather(self._seat_one.notify(message), self._seat_two.notify(message))
+
+    async def _handle_discards(self):
+        """
+        Asks both seats for their discards at the same time, then puts them into the crib
+        """
+        dealer = 1 if self.game.dealer == self.game.player_one else 0
+        player_one_discards, player_two_discards = await asyncio.gather(
+            self._seat_one.select_discards(dealer=dealer, opp_score=self.game.player_two.score),
+            self._seat_two.select_discards(dealer=(dealer + 1) % 2, opp_score=self.game.player_one.score)
+        )
+        self.game.add_discards(player_one_discards, player_two_discards)
+
+    async def play_round(self):
+        """
+        Plays one round the same way vs_tester does: deal, discard, then score the hands and crib with the starter card
+        """
+        self.game.initialize_round()
+        self.game.deal_cards()
+        await self._handle_discards()
+
+        self.game.score_non_dealer()
+        if self.game.get_winner() == None:
+            self.game.score_dealer()
+            self.game.score_crib()
+
+        await self._notify_all('Starter: ' + str(self.game.deck.cards[-1]) + '\nScores: ' + str(self.game.player_one) + ' '
+                               + str(self.game.player_one.score) + ', ' + str(self.game.player_two) + ' ' + str(self.game.player_two.score))
+        self.game.reset_game()
+
+    async def play_game(self) -> Player:
+        """
+        Plays rounds until someone wins, then starts a new game and returns the winner
+        """
+        while self.game.get_winner() == None:
+            await self.play_round()
+
+        winner = self.game.get_winner()
+        await self._notify_all(str(winner) + ' wins!')
+        self.game.start_new_game()
+        return winner
+
+
+
+class GameServer():
+    """
+    Hosts many cribbage tables in one asyncio event loop. Humans connect over a local TCP socket and are seated against a bot,
+    and tables of only bots can be added to run alongside them. Bot decisions run on a shared executor,
+    and every network bot's predictions are batched together through one inference service.
+    """
+    def __init__(self, host : str='127.0.0.1', port : int=8121, max_bot_workers : int=None, network_model : str=None, winning_score : int=121):
+        self._host = host
+        self._port = port
+        self._network_model = network_model
+        self._winning_score = winning_score
+        self._executor = ThreadPoolExecutor(max_workers=max_bot_workers if max_bot_workers != None else os.cpu_count())
+        self._table_ids = itertools.count()
+        self._tables = dict()
+        self._bot_tasks = set()
+        self._server = None
+        self._inference_service = None
+
+    @property
+    def tables(self) -> dict[int, Table]:
+        """
+        Returns the tables currently being played, by table id
+        """
+        return dict(self._tables)
+
+    def _bot_seat(self, bot_type : str, name : str) -> BotSeat:
+        """
+        Creates a seat holding a new bot of the given type
+        """
+        if bot_type == 'network' and self._inference_service == None:
+            self._inference_service = DiscardInferenceService(create_bot('network', 'Inference Model', self._network_model)._discard_network)
+        return BotSeat(create_bot(bot_type, name, self._network_model, self._inference_service), self._executor)
+
+    async def _run_table(self, table : Table, num_games : int=None) -> list[Player]:
+        """
+        Plays num_games games at the table, or games until a human leaves if num_games is None, and returns the winners
+        """
+        self._tables[table.table_id] = table
+        winners = []
+        try:
+            games = itertools.count() if num_games == None else range(num_games)
+            for _ in games:
+                winners.append(await table.play_game())
+        except ConnectionError:
+            pass
+        finally:
+            del self._tables[table.table_id]
+        return winners
+
+    async def play_bot_table(self, player_one_type : str='naive', player_two_type : str='random', num_games : int=1) -> list[Player]:
+        """
+        Seats two bots at a new table, plays num_games games and returns the winners
+        """
+        table_id = next(self._table_ids)
+        table = Table(table_id, self._bot_seat(player_one_type, player_one_type + ' ' + str(table_id) + '-1'),
+                      self._bot_seat(player_two_type, player_two_type + ' ' + str(table_id) + '-2'), self._winning_score)
+        return await self._run_table(table, num_games)
+
+    async def _handle_connection(self, reader : asyncio.StreamReader, writer : asyncio.StreamWriter):
+        """
+        Seats a newly connected human against the bot type they ask for, then plays games with them until they disconnect
+        """
+        try:
+            writer.write(('Choose an opponent (' + ', '.join(BOT_TYPES) + '): \n').encode())
+            await writer.drain()
+            bot_type = (await reader.readline()).decode().strip().lower()
+            if bot_type not in BOT_TYPES:
+                writer.write((bot_type + ' is not an opponent.\n').encode())
+                return
+
+            table_id = next(self._table_ids)
+            human = HumanSeat(HumanPlayer('Human ' + str(table_id)), reader, writer)
+            await self._run_table(Table(table_id, human, self._bot_seat(bot_type, bot_type + ' ' + str(table_id)), self._winning_score))
+        finally:
+            writer.close()
+
+    async def start(self):
+        """
+        Starts accepting human connections
+        """
+        self._server = await asyncio.start_server(self._handle_connection, self._host, self._port)
+
+    async def serve_forever(self, bot_tables : int=0, player_one_type : str='naive', player_two_type : str='random'):
+        """
+        Accepts human connections forever, while also playing the given number of bot only tables nonstop
+        """
+        await self.start()
+        for _ in range(bot_tables):
+            task = asyncio.ensure_future(self.play_bot_table(player_one_type, player_two_type, num_games=None))
+            self._bot_tasks.add(task)
+            task.add_done_callback(self._bot_tasks.discard)
+        async with self._server:
+            await self._server.serve_forever()
+
+    def close(self):
+        """
+        Stops accepting connections and shuts down the bot executor
+        """
+        if self._server != None:
+            self._server.close()
+        for task in self._bot_tasks:
+            task.cancel()
+        self._executor.shutdown(wait=False)
+        if self._inference_service != None:
+            self._inference_service.close()
@@ -0,0 +1,91 @@
+from concurrent.futures import Future
+import asyncio
+import queue
+import threading
+import time
+import numpy as np
+import tensorflow as tf
+
+
+
+class DiscardInferenceService():
+    """
+    Batches discard network predictions from many threads or coroutines into single model calls.
+    A batch is run as soon as it has max_batch_size requests, or max_delay seconds after its first request arrived.
+    """
+    def __init__(self, model : tf.keras.Model, max_batch_size : int=64, max_delay : float=0.002):
+        self._model = model
+        self._max_batch_size = max_batch_size
+        self._max_delay = max_delay
+        self._requests = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name='discard-inference', daemon=True)
+        self._worker.start()
+
+    def submit(self, model_input) -> Future:
+        """
+        Queues a single encoded input and returns a future that will hold the model's output for it
+        """
+        future = Future()
+        self._requests.put((np.asarray(model_input, dtype=np.float32), future))
+        return future
+
+    def predict(self, model_input) -> np.ndarray:
+        """
+        Queues a single encoded input and waits for the model's output for it
+        """
+        return self.submit(model_input).result()
+
+    async def predict_async(self, model_input) -> np.ndarray:
+        """
+        Queues a single encoded input and awaits the model's output for it without blocking the event loop
+        """
+        return await asyncio.wrap_future(self.submit(model_input))
+
+    def _collect_batch(self) -> list:
+        """
+        Waits for a first request, then gathers more until the batch is full or the deadline passes. Returns None when closed.
+        """
+        first = self._requests.get()
+        if first == None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self._max_delay
+        while len(batch) < self._max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self._requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            ### Put the close signal back so the loop sees it after this batch
+            if request == None:
+                self._requests.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        """
+        Runs batches through the model until closed, handing each caller its row of the output
+        """
+        while True:
+            batch = self._collect_batch()
+            if batch == None:
+                return
+            futures = [future for _, future in batch]
+            try:
+                outputs = self._model(np.stack([model_input for model_input, _ in batch]), training=False).numpy()
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, output in zip(futures, outputs):
+                future.set_result(output)
+
+    def close(self):
+        """
+        Finishes any queued requests and stops the worker thread
+        """
+        self._requests.put(None)
+        self._worker.join()
@@ -0,0 +1,112 @@
+from src.card import Deck
+from src.scoring import Hand
+from src.player import Player, NaivePlayer
+import numpy as np
+
+
+
+def round_point_distributions(pone : Player=None, dealer : Player=None, num_rounds : int=20_000) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Simulates rounds with the scoring engine and returns the distribution of points the non dealer scores with their hand,
+    and of points the dealer scores with their hand and crib. Both players are naive by default. Pegging isn't played.
+    """
+    pone = NaivePlayer('Pone') if pone == None else pone
+    dealer = NaivePlayer('Dealer') if dealer == None else dealer
+    pone_counts = np.zeros(30)
+    dealer_counts = np.zeros(60)
+    deck = Deck()
+
+    for _ in range(num_rounds):
+        deck.shuffle()
+        pone._hand = Hand(deck.cards[:6])
+        dealer._hand = Hand(deck.cards[6:12])
+        starter = deck.cards[12]
+        crib = pone.select_discards(0, 0) + dealer.select_discards(1, 0)
+
+        pone_counts[Hand(pone.hand.cards + [starter]).score] += 1
+        dealer_counts[Hand(dealer.hand.cards + [starter]).score + Hand(crib + [starter]).score] += 1
+
+    return pone_counts / pone_counts.sum(), dealer_counts / dealer_counts.sum()
+
+
+def _ahead(distribution : np.ndarray, row : np.ndarray, fill : float) -> np.ndarray:
+    """
+    For every index b of the row, returns the sum over k of distribution[k] * row[b + k], where the row continues with fill past its end
+    """
+    extended = np.concatenate([row, np.full(len(distribution), fill)])
+    return np.correlate(extended, distribution, 'valid')[:len(row)]
+
+
+def build_match_equity(pone_points : np.ndarray, dealer_points : np.ndarray, winning_score : int=121) -> np.ndarray:
+    """
+    Computes the probability of winning from every (my score, opponent score) state, for when I'm not dealing (index 0) and dealing (index 1).
+    A round is the non dealer scoring pone_points, then, if they haven't won, the dealer scoring dealer_points. The deal then alternates.
+    States are solved from the highest scores down, so each only depends on states already solved, apart from a round where
+    nobody scores, which links the two dealer states of the same scores and is solved directly.
+    """
+    pone_points = np.asarray(pone_points, dtype=np.float64)
+    dealer_points = np.asarray(dealer_points, dtype=np.float64)
+    target = winning_score
+    ### Win probability when I'm the non dealer, and when I'm the dealer
+    pone_equity = np.zeros((target, target))
+    dealer_equity = np.zeros((target, target))
+    nobody_scores = pone_points[0] * dealer_points[0]
+    can_still_score = np.ones(target)
+
+    for a in range(target - 1, -1, -1):
+        ### Everything that doesn't stay on row a can be summed for every opponent score at once
+        pone_rest = np.zeros(target)
+        for x in range(1, len(pone_points)):
+            if a + x >= target:
+                pone_rest += pone_points[x]
+            else:
+                pone_rest += pone_points[x] * _ahead(dealer_points, dealer_equity[a + x], 0.0)
+
+        dealer_rest = np.zeros(target)
+        for y in range(1, len(dealer_points)):
+            if a + y >= target:
+                dealer_rest += dealer_points[y] * _ahead(pone_points, can_still_score, 0.0)
+            else:
+                dealer_rest += dealer_points[y] * _ahead(pone_points, pone_equity[a + y], 0.0)
+
+        ### The rest stays on row a, where higher opponent scores are already solved
+        for b in range(target - 1, -1, -1):
+            pone_total = pone_rest[b] + pone_points[0] * np.dot(dealer_points[1:target - b], dealer_equity[a, b + 1:b + len(dealer_points)])
+            dealer_total = dealer_rest[b] + dealer_points[0] * np.dot(pone_points[1:target - b], pone_equity[a, b + 1:b + len(pone_points)])
+            pone_equity[a, b] = (pone_total + nobody_scores * dealer_total) / (1 - nobody_scores ** 2)
+            dealer_equity[a, b] = dealer_total + nobody_scores * pone_equity[a, b]
+
+    return np.stack([pone_equity, dealer_equity])
+
+
+
+class MatchEquityTable():
+    """
+    A memory mapped table of win probabilities for every (my score, opponent score, dealer) state, looked up in constant time.
+    """
+    def __init__(self, path : str):
+        self._table = np.load(path, mmap_mode='r')
+        self._winning_score = self._table.shape[-1]
+
+    @staticmethod
+    def build(path : str, pone : Player=None, dealer : Player=None, num_rounds : int=20_000, winning_score : int=121) -> 'MatchEquityTable':
+        """
+        Simulates the point distributions, solves the table, saves it to the given path and opens it
+        """
+        pone_points, dealer_points = round_point_distributions(pone, dealer, num_rounds)
+        np.save(path, build_match_equity(pone_points, dealer_points, winning_score).astype(np.float32))
+        return MatchEquityTable(path)
+
+    @property
+    def winning_score(self) -> int:
+        return self._winning_score
+
+    def win_probability(self, my_score : int, opp_score : int, dealer : int) -> float:
+        """
+        Returns the probability of winning at the start of a round with the given scores, dealer being 1 if I'm dealing
+        """
+        if my_score >= self._winning_score:
+            return 1.0
+        if opp_score >= self._winning_score:
+            return 0.0
+        return float(self._table[dealer, my_score, opp_score])
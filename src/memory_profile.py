@@ -0,0 +1,107 @@
+from src.metrics import MetricsWriter
+import os
+import resource
+import time
+import tracemalloc
+
+
+
+### The series recorded for every memory sample
+MEMORY_SERIES = ['time', 'rss_mb', 'traced_mb', 'traced_peak_mb']
+
+### Allocations made by tracemalloc itself and by the import machinery aren't interesting
+_IGNORED_TRACES = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                   tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'), tracemalloc.Filter(False, '<unknown>')]
+
+
+def current_rss_mb() -> float:
+    """
+    Returns the resident set size of this process in megabytes, or its peak where the current size can't be read
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except (OSError, ValueError):
+        ### Linux reports the peak in kilobytes, macOS in bytes
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 10 if os.uname().sysname == 'Linux' else peak / 2 ** 20
+
+
+
+class MemoryProfiler():
+    """
+    Opt in memory instrumentation for long runs. Every interval calls of step, it records the RSS and the memory traced
+    by tracemalloc to a timeline in the directory (readable with metrics.MetricsReader), and appends the allocation sites
+    that grew the most since the previous sample to report.txt. Closing it also reports the growth since the first sample.
+    Tracing slows Python down, so only use it when looking for a leak.
+    """
+    def __init__(self, directory : str='memory', interval : int=100, top : int=10, frames : int=1):
+        """
+        frames is how many stack frames each allocation site is traced with, growth is grouped by whole traceback when above 1
+        """
+        self._interval = interval
+        self._top = top
+        self._group_by = 'lineno' if frames <= 1 else 'traceback'
+        self._started_tracing = not tracemalloc.is_tracing()
+        if self._started_tracing:
+            tracemalloc.start(frames)
+
+        self._timeline = MetricsWriter(directory, MEMORY_SERIES, flush_every=1)
+        self._report_path = os.path.join(directory, 'report.txt')
+        self._calls = 0
+        self._first = None
+        self._previous = None
+
+    def step(self, label : str=''):
+        """
+        Counts a step of the run being profiled, taking a sample every interval steps
+        """
+        self._calls += 1
+        if self._calls % self._interval == 0:
+            self.sample(label)
+
+    def sample(self, label : str=''):
+        """
+        Records the memory in use now and reports which allocation sites grew since the last sample
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_TRACES)
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        self._timeline.log(time=time.time(), rss_mb=current_rss_mb(), traced_mb=traced / 2 ** 20, traced_peak_mb=traced_peak / 2 ** 20)
+
+        if self._previous != None:
+            self._report(f'Growth since the previous sample at step {self._calls} {label}', snapshot.compare_to(self._previous, self._group_by))
+        else:
+            self._first = snapshot
+        self._previous = snapshot
+
+    def growth(self) -> list[tracemalloc.StatisticDiff]:
+        """
+        Returns the allocation sites that grew since the first sample, largest growth first
+        """
+        if self._first == None or self._previous is self._first:
+            return []
+        return [diff for diff in self._previous.compare_to(self._first, self._group_by) if diff.size_diff > 0]
+
+    def _report(self, heading : str, diffs : list[tracemalloc.StatisticDiff]):
+        """
+        Appends the top growing allocation sites to the report
+        """
+        growing = [diff for diff in diffs if diff.size_diff > 0][:self._top]
+        with open(self._report_path, 'a') as f:
+            f.write(heading + ' (RSS ' + format(current_rss_mb(), '.1f') + ' MB)\n')
+            for diff in growing:
+                f.write('  ' + str(diff) + '\n')
+                if self._group_by == 'traceback':
+                    for line in diff.traceback.format()[1:]:
+                        f.write('    ' + line + '\n')
+            f.write('\n')
+
+    def close(self):
+        """
+        Takes a last sample, reports the growth over the whole run, and stops tracing if this profiler started it
+        """
+        self.sample('(end)')
+        self._report(f'Growth over the whole run, {self._calls} steps', self.growth())
+        self._timeline.close()
+        if self._started_tracing:
+            tracemalloc.stop()
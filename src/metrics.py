@@ -0,0 +1,177 @@
+import json
+import os
+import numpy as np
+
+
+
+### The series recorded for every training batch
+TRAINING_SERIES = ['tester_avg', 'model_avg', 'loss', 'epsilon', 'step_time']
+
+
+def _column_path(directory : str, name : str) -> str:
+    """
+    Returns the path of the column file holding the given series
+    """
+    return os.path.join(directory, name + '.f8')
+
+
+
+class MetricsWriter():
+    """
+    Buffers rows of named metric series and appends them to a directory holding one raw little endian float64 file per series.
+    Rows are only written every flush_every rows, and every column is written on each flush so the columns stay the same length.
+    """
+    def __init__(self, directory : str='metrics', series : list[str]=TRAINING_SERIES, flush_every : int=100):
+        self._directory = directory
+        self._series = list(series)
+        self._flush_every = flush_every
+        self._rows = []
+
+        os.makedirs(directory, exist_ok=True)
+        schema_path = os.path.join(directory, 'schema.json')
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                if json.load(f)['series'] != self._series:
+                    raise ValueError('The metrics in ' + directory + ' were written with different series.')
+        else:
+            with open(schema_path, 'w') as f:
+                json.dump({'series': self._series}, f)
+
+    @property
+    def series(self) -> list[str]:
+        """
+        Returns the names of the series being written
+        """
+        return list(self._series)
+
+    def log(self, **values : float):
+        """
+        Buffers a row of values, any series without a value is recorded as NaN
+        """
+        unknown = set(values) - set(self._series)
+        if len(unknown) > 0:
+            raise ValueError('Unknown metric series: ' + ', '.join(sorted(unknown)))
+        self._rows.append([values.get(name, np.nan) for name in self._series])
+        if len(self._rows) >= self._flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Appends every buffered row to the column files
+        """
+        if len(self._rows) == 0:
+            return
+        columns = np.asarray(self._rows, dtype='<f8').T
+        for name, column in zip(self._series, columns):
+            with open(_column_path(self._directory, name), 'ab') as f:
+                column.tofile(f)
+        self._rows.clear()
+
+    def close(self):
+        """
+        Writes any remaining buffered rows
+        """
+        self.flush()
+
+
+
+class MetricsReader():
+    """
+    Reads the series written by a MetricsWriter, remembering how far it has read so later calls only read new rows.
+    """
+    def __init__(self, directory : str='metrics'):
+        self._directory = directory
+        with open(os.path.join(directory, 'schema.json')) as f:
+            self._series = json.load(f)['series']
+        self._rows_read = 0
+
+    @property
+    def series(self) -> list[str]:
+        """
+        Returns the names of the series in the directory
+        """
+        return list(self._series)
+
+    @property
+    def rows_read(self) -> int:
+        """
+        Returns how many rows have been read so far
+        """
+        return self._rows_read
+
+    def _rows_available(self) -> int:
+        """
+        Returns the number of complete rows on disk. A column can be ahead of the others while a flush is in progress.
+        """
+        sizes = []
+        for name in self._series:
+            path = _column_path(self._directory, name)
+            sizes.append(os.path.getsize(path) // 8 if os.path.exists(path) else 0)
+        return min(sizes)
+
+    def read_new(self) -> dict[str, np.ndarray]:
+        """
+        Returns the rows written since the last read for every series
+        """
+        rows = self._rows_available()
+        count = rows - self._rows_read
+        values = dict()
+        for name in self._series:
+            if count <= 0:
+                values[name] = np.empty(0)
+                continue
+            with open(_column_path(self._directory, name), 'rb') as f:
+                values[name] = np.fromfile(f, dtype='<f8', count=count, offset=self._rows_read * 8)
+        self._rows_read = rows
+        return values
+
+    def read_all(self) -> dict[str, np.ndarray]:
+        """
+        Returns every row written so far for every series, and continues tailing from the end
+        """
+        self._rows_read = 0
+        return self.read_new()
+
+
+
+class ResultsFileReader():
+    """
+    Reads the tester and model averages train_discard_model appends to results.txt when it isn't given a metrics writer,
+    remembering how far it has read like MetricsReader, so runs without a metrics directory can still be plotted.
+    """
+    def __init__(self, path : str='results.txt'):
+        self._path = path
+        self._rows_read = 0
+
+    @property
+    def series(self) -> list[str]:
+        """
+        Returns the names of the series in the file
+        """
+        return ['tester_avg', 'model_avg']
+
+    @property
+    def rows_read(self) -> int:
+        """
+        Returns how many rows have been read so far
+        """
+        return self._rows_read
+
+    def read_new(self) -> dict[str, np.ndarray]:
+        """
+        Returns the rows written since the last read for every series
+        """
+        with open(self._path) as f:
+            text = f.read()
+        ### A line without its newline may still be being written
+        lines = text[:text.rfind('\n') + 1].splitlines()
+        rows = np.array([[float(value) for value in line.split(',')] for line in lines[self._rows_read:]]).reshape(-1, 2)
+        self._rows_read = len(lines)
+        return {'tester_avg': rows[:, 0], 'model_avg': rows[:, 1]}
+
+    def read_all(self) -> dict[str, np.ndarray]:
+        """
+        Returns every row written so far for every series, and continues tailing from the end
+        """
+        self._rows_read = 0
+        return self.read_new()
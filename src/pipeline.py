@@ -0,0 +1,45 @@
+from src.card import Card
+from src.encoding import encode_discard_inputs, encode_compact_inputs, INPUT_SIZE, COMPACT_INPUT_SIZE
+from src.evaluation import deal_scenarios, scenario_outcomes
+import numpy as np
+import tensorflow as tf
+
+
+
+def discard_dataset(hands : list[list[Card]], batch_size : int=32, seed : int=None, parallel_calls : int=tf.data.AUTOTUNE,
+                    compact : bool=False) -> tf.data.Dataset:
+    """
+    Creates an endless dataset of (input, full target vector) batches for training the discard network.
+    Each batch deals random hands from the given hands and simulates all 15 of their discards on parallel map workers,
+    and batches are prefetched so the next one is simulated while the current one trains.
+    The targets don't depend on the model, which is what lets simulation run ahead of training.
+    Simulation runs in python through tf.numpy_function, which holds the GIL, so map workers only run in parallel with each other
+    and with training while numpy has released it. Each batch is dealt and scored with numpy array operations rather than
+    card by card, which keeps the time spent holding the GIL to a little python per batch.
+    With compact set, inputs are encoded for a compact input network, 9 floats per hand instead of 321.
+    With a seed, every batch simulates with its own stream of the seed and batches keep their order, so the dataset is reproducible.
+    """
+    encode = encode_compact_inputs if compact else encode_discard_inputs
+    input_size = COMPACT_INPUT_SIZE if compact else INPUT_SIZE
+    hand_indexes = np.sort(np.array([[card.index for card in hand] for hand in hands], dtype=np.int64), axis=1)
+
+    def simulate(batch_index : np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Deals a batch of hands, simulates the discard targets of every hand and encodes them
+        """
+        ### Map workers run batches in any order, so each batch draws from its own stream rather than a shared generator
+        rng = np.random.default_rng(None if seed == None else [seed, int(batch_index)])
+        scenarios = deal_scenarios(hand_indexes[rng.integers(0, len(hand_indexes), batch_size)], rng)
+        zeros = np.zeros(batch_size)
+        model_inputs = encode(scenarios.cards + 1, scenarios.dealer, zeros, zeros)
+        return model_inputs.astype(np.float32), scenario_outcomes(scenarios).astype(np.float32)
+
+    def simulate_in_graph(batch_index : tf.Tensor) -> tuple[tf.Tensor, tf.Tensor]:
+        model_inputs, targets = tf.numpy_function(simulate, [batch_index], [tf.float32, tf.float32])
+        model_inputs.set_shape((batch_size, input_size))
+        targets.set_shape((batch_size, 15))
+        return model_inputs, targets
+
+    dataset = tf.data.Dataset.range(np.iinfo(np.int64).max)
+    dataset = dataset.map(simulate_in_graph, num_parallel_calls=parallel_calls, deterministic=seed != None)
+    return dataset.prefetch(tf.data.AUTOTUNE)
@@ -1,10 +1,22 @@
 from abc import ABCMeta, abstractmethod
-from src.scoring import Hand, PeggingPile
+from src.scoring import Hand, BitHand, PeggingPile
 from src.card import Card, Deck
+from src.checkpoint import CheckpointManager
+from src.discards import naive_option, sample_discard_targets, sample_discard_target
+from src.replay import PrioritizedReplayBuffer
+from src.metrics import MetricsWriter
+from src.inference import DiscardInferenceService
+from src.crib_model import OpponentDiscardModel
+from src.memory_profile import MemoryProfiler
+from src.encoding import encode_compact_input
+from src.embedding import create_compact_discard_network, compact_weights
+from src.compiled import CompiledDiscardModel, compiled_discard_model
+import numpy as np
 import pandas as pd
 import tensorflow as tf
 import random
 import itertools
+import time
 
 
 
@@ -12,8 +24,10 @@ class Player(metaclass=ABCMeta):
     """Abstract Base Class for a Player"""
     def __init__(self, name='John Doe'):
         self._name = name
-        self._hand = Hand()
+        self._hand = BitHand()
         self._score = 0
+        ### None for the global generator, the random module itself can't be pickled or copied
+        self._generator = None
 
     def __str__(self) -> str:
         return '[Player: ' + self.name + ']'
@@ -50,12 +64,42 @@ class Player(metaclass=ABCMeta):
         Function that clears the hand and returns all the cards that were in hand
         """
         cards_in_hand = self.hand.cards.copy()
-        self.hand.cards.clear()
+        self.hand.clear()
         return cards_in_hand
 
     def clear_score(self):
         self._score = 0
 
+    @property
+    def hand_state(self) -> tuple[int, int]:
+        """
+        Returns the state of the hand as a BitHand would, see BitHand.state
+        """
+        if isinstance(self._hand, BitHand):
+            return self._hand.state
+        return BitHand(self._hand.cards).state
+
+    def restore_hand(self, state : tuple[int, int]):
+        """
+        Puts the hand back to a state returned by hand_state, reusing the hand if it's a BitHand
+        """
+        if not isinstance(self._hand, BitHand):
+            self._hand = BitHand()
+        self._hand.restore(state)
+
+    def use_rng(self, rng : random.Random=None):
+        """
+        Makes any random choices of the player with the given random generator from now on, None for the global one
+        """
+        self._generator = rng
+
+    @property
+    def _rng(self):
+        """
+        Returns the random generator the player draws from, the global one unless another was given
+        """
+        return random if self._generator == None else self._generator
+
     @abstractmethod
     def select_peg_card(self, pegging_pile : PeggingPile, opp_score : int=0) -> Card:
         """
@@ -87,7 +131,7 @@ class RandomPlayer(Player):
         super().__init__(name)
 
     def select_discards(self, dealer : int=0, opp_score : int=0) -> list[Card]:
-        cards_to_discard = random.sample(self.hand.cards, 2)
+        cards_to_discard = self._rng.sample(self.hand.cards, 2)
         self.hand.discard(cards_to_discard)
         return cards_to_discard
 
@@ -95,9 +139,9 @@ class RandomPlayer(Player):
         ### First, make sure we can play a card
         super().select_peg_card(pegging_pile)
         ### Select a random card until you pick a card that can be played
-        card_to_play = random.choice(self.hand.cards)
+        card_to_play = self._rng.choice(self.hand.cards)
         while card_to_play.value + pegging_pile.current_total > 31:
-            card_to_play = random.choice(self.hand.cards)
+            card_to_play = self._rng.choice(self.hand.cards)
         
         ### Discard that card from hand and return it
         self.hand.discard([card_to_play])
@@ -181,19 +225,12 @@ class NaivePlayer(Player):
         highest_score = 0
         selected_card = None
 
-        ### For every card, create a new pegging pile containing the current cards in play and add the new card
-        for card in self.hand.cards:
-            temp_pile = PeggingPile(pegging_pile.cards_in_play)
-            ### If the new card added sends back an error, it means that card can't be played
-            try:
-                temp_score = temp_pile.add_to_play(card)
-            except ValueError:
-                ### Can't play this card, set the temp score to less than 0
-                temp_score = -1
-            
-            ### Check the new score
-            if highest_score <= temp_score:
-                highest_score = temp_pile.score
+        ### Score every card against the pile at once, cards that can't be played are never selected
+        cards = self.hand.cards
+        points, legal = pegging_pile.evaluate_plays(cards)
+        for card, card_points, card_legal in zip(cards, points, legal):
+            if card_legal and highest_score <= card_points:
+                highest_score = card_points
                 selected_card = card
 
         return selected_card
@@ -201,11 +238,29 @@ class NaivePlayer(Player):
 
 
 class NetworkPlayer(Player):
-    def __init__(self, name='Network Player'):
+    def __init__(self, name='Network Player', inference_service : DiscardInferenceService=None, layer_widths : tuple[int]=(56, 56, 25, 20),
+                 learning_rate : float=0.001, eps : float=0.8, decay : float=0.9, compact_input : bool=False, compiled : bool=True,
+                 jit_compile : bool=False, build_network : bool=True):
+        """
+        With compact_input, the discard network takes six card ids and the scalar features instead of one hot card slots.
+        With compiled, predictions and training steps go through fixed signature tf.functions instead of Keras predict and fit,
+        compiled with XLA if jit_compile is set as well.
+        Without build_network, the player has no discard network of its own and discards through the inference service,
+        so many players can share one model.
+        """
+        if not build_network and inference_service == None:
+            raise ValueError('A network player without its own network needs an inference service.')
         super().__init__(name)
-        self._discard_network = self._create_discard_network()
-        self._eps = 0.8
-        self._decay = 0.9
+        self._layer_widths = tuple(layer_widths)
+        self._learning_rate = learning_rate
+        self._compact_input = compact_input
+        self._compiled = compiled
+        self._jit_compile = jit_compile
+        self._discard_network = self._create_discard_network() if build_network else None
+        self._inference_service = inference_service
+        self._eps = eps
+        self._initial_eps = eps
+        self._decay = decay
         
         self._pegging_network = self._create_pegging_network()
         self._converter = self._create_hand_converter()
@@ -234,17 +289,19 @@ class NetworkPlayer(Player):
 
     def _create_discard_network(self) -> tf.keras.Model:
         """
-        Creates the discard network model
+        Creates the discard network model, with a relu hidden layer for each of the player's layer widths
         """
-        inputs = tf.keras.layers.Input((321,))
-        dense1 = tf.keras.layers.Dense(56, activation='relu')(inputs)
-        dense2 = tf.keras.layers.Dense(56, activation='relu')(dense1)
-        dense3 = tf.keras.layers.Dense(25, activation='relu')(dense2)
-        dense4 = tf.keras.layers.Dense(20, activation='relu')(dense3)
-        outputs = tf.keras.layers.Dense(15, activation='linear')(dense4)
-
-        model = tf.keras.Model(inputs=inputs, outputs=outputs, name='crib_discard_model')
-        model.compile(optimizer=tf.keras.optimizers.Adam(), loss=tf.keras.losses.MeanAbsoluteError(), metrics=[tf.keras.losses.MeanSquaredError(), tf.keras.losses.Huber()])
+        if self._compact_input:
+            model = create_compact_discard_network(self._layer_widths)
+        else:
+            inputs = tf.keras.layers.Input((321,))
+            hidden = inputs
+            for width in self._layer_widths:
+                hidden = tf.keras.layers.Dense(width, activation='relu')(hidden)
+            outputs = tf.keras.layers.Dense(15, activation='linear')(hidden)
+            model = tf.keras.Model(inputs=inputs, outputs=outputs, name='crib_discard_model')
+
+        model.compile(optimizer=tf.keras.optimizers.Adam(self._learning_rate), loss=tf.keras.losses.MeanAbsoluteError(), metrics=[tf.keras.losses.MeanSquaredError(), tf.keras.losses.Huber()])
         return model
 
     def _create_pegging_network(self) -> tf.keras.Model:
@@ -257,12 +314,15 @@ class NetworkPlayer(Player):
         deck_vocabulary = [str(card) for card in Deck().cards]
         return tf.keras.layers.StringLookup(vocabulary=deck_vocabulary, output_mode='one_hot')
 
-    def _convert_hand_to_input(self, dealer : int, opp_score : int) -> tf.Tensor:
+    def _convert_hand_to_input(self, dealer : int, opp_score : int, sorted_cards : list[Card]=None) -> tf.Tensor:
         """
-        Converts discard input into a tensor and returns it
+        Converts discard input into a tensor and returns it. The hand's cards can be passed in already sorted.
         """
         ### Create hand as strings, sorted
-        sorted_hand = [str(card) for card in sorted(self.hand.cards)]
+        sorted_cards = sorted(self.hand.cards) if sorted_cards == None else sorted_cards
+        if self._compact_input:
+            return tf.convert_to_tensor(encode_compact_input(sorted_cards, dealer, self.score, opp_score))
+        sorted_hand = [str(card) for card in sorted_cards]
         encoded_hand = self._converter(sorted_hand)
         collapsed_hand = tf.concat([card for card in encoded_hand], 0)
         return tf.concat([collapsed_hand, [dealer, self.score / 121.0, opp_score / 121.0]], 0)
@@ -275,6 +335,56 @@ class NetworkPlayer(Player):
         Loads the discard model's weights using the given filename
         """
         self._discard_network.load_weights(filename)
+        ### Compile ahead of the first decision rather than during it
+        if self._compiled:
+            self._compiled_model()
+
+    def _compiled_model(self, train_batch_size : int=32) -> CompiledDiscardModel:
+        """
+        Returns the compiled functions of the current discard network, shared by every player using the same network in this process
+        """
+        return compiled_discard_model(self._discard_network, train_batch_size, self._jit_compile)
+
+    def _predict(self, inputs) -> np.ndarray:
+        """
+        Returns the discard network's outputs for a batch of inputs
+        """
+        if self._compiled:
+            return self._compiled_model().predict(inputs)
+        return self._discard_network.predict(inputs, verbose=0)
+
+    def _train_on_batch(self, inputs, targets, sample_weight=None) -> float:
+        """
+        Takes one training step on a batch of inputs and targets and returns the loss
+        """
+        if self._compiled:
+            return self._compiled_model(len(inputs)).train_step(inputs, targets, sample_weight)
+        history = self._discard_network.fit(inputs, targets, sample_weight=sample_weight, batch_size=len(inputs), epochs=1, verbose=0)
+        return history.history['loss'][-1]
+
+    @property
+    def compact_input(self) -> bool:
+        """
+        Returns whether the discard network takes compact card id inputs
+        """
+        return self._compact_input
+
+    def convert_to_compact_input(self):
+        """
+        Replaces the one hot discard network with a compact input network computing the same outputs, keeping the trained weights
+        """
+        if self._compact_input:
+            return
+        weights = self._discard_network.get_weights()
+        self._compact_input = True
+        self._discard_network = self._create_discard_network()
+        self._discard_network.set_weights(compact_weights(weights))
+
+    def use_inference_service(self, inference_service : DiscardInferenceService):
+        """
+        Sends discard predictions through the given inference service instead of this player's own network, None to stop
+        """
+        self._inference_service = inference_service
 
     def select_discards(self, dealer : int=0, opp_score : int=0, training : bool = False) -> list[Card]:
         """
@@ -282,15 +392,19 @@ class NetworkPlayer(Player):
         Also saves the input into the player's discard input history
         """
         ### Convert hand, dealer and opponent score as list into self._discard_inputs, then convert it to tensor for prediction
-        hand_as_input = tf.convert_to_tensor([self._convert_hand_to_input(dealer, opp_score)])
+        sorted_cards = sorted(self.hand.cards)
+        hand_as_input = tf.convert_to_tensor([self._convert_hand_to_input(dealer, opp_score, sorted_cards)])
 
-        ### Get prediction into discard output property
-        discard_output = list(self._discard_network.predict(hand_as_input, verbose=0)[0])
+        ### Get prediction into discard output property, batched with other players' requests if sharing an inference service
+        if self._inference_service != None:
+            discard_output = list(self._inference_service.predict(hand_as_input[0]))
+        else:
+            discard_output = list(self._predict(hand_as_input)[0])
         self._output_arr = discard_output
 
         
-        if random.uniform(0, 1) < self._eps and training:
-            discard_chosen_index = random.randint(0, 14)
+        if self._rng.uniform(0, 1) < self._eps and training:
+            discard_chosen_index = self._rng.randint(0, 14)
         else:
             ### Convert prediction to index and set discard chosen index to it
             discard_chosen_index = int(tf.argmax(discard_output))
@@ -298,7 +412,7 @@ class NetworkPlayer(Player):
         ### Choose cards using discard mapping, then remove them from hand and return them
         self._chosen_arg = discard_chosen_index
         cards_to_discard_index = self._discard_mapping[discard_chosen_index]
-        selected_discards = [sorted(self.hand.cards)[cards_to_discard_index[0]], sorted(self.hand.cards)[cards_to_discard_index[1]]]
+        selected_discards = [sorted_cards[cards_to_discard_index[0]], sorted_cards[cards_to_discard_index[1]]]
         self.hand.discard(selected_discards)
 
         return selected_discards
@@ -311,20 +425,77 @@ class NetworkPlayer(Player):
 
         return None
 
-    def train_discard_model(self, hands: list[list[Card]], i: int):
+    def _full_discard_target(self, hand : list[Card]) -> tuple[tf.Tensor, list[int], int, int]:
+        """
+        Deals an adversary hand and starter card from the cards not in the given hand, then scores all 15 discards against them.
+        Returns the model input, the full target vector, and the scores of the model's and the naive tester's discards.
+        """
+        cards = sorted(hand)
+        dealer, targets = sample_discard_targets(cards, self._rng)
+        tester_option = naive_option(cards)
+
+        self._hand = Hand(cards.copy())
+        sample = self._convert_hand_to_input(dealer, 0)
+        self.select_discards(dealer, 0, True)
+
+        return sample, targets, targets[self._chosen_arg], targets[tester_option]
+
+    def _chosen_discard_target(self, hand : list[Card]) -> tuple[tf.Tensor, int]:
+        """
+        Like _full_discard_target, but only scores the model's discard, for when the other targets aren't trained on.
+        Returns the model input and the score of the model's discard.
+        """
+        cards = sorted(hand)
+        dealer = self._rng.randrange(0, 2)
+
+        self._hand = Hand(cards.copy())
+        sample = self._convert_hand_to_input(dealer, 0)
+        self.select_discards(dealer, 0, True)
+
+        return sample, sample_discard_target(cards, self._chosen_arg, dealer, self._rng)
+
+    def _fit_from_replay(self, replay_buffer : PrioritizedReplayBuffer, batch_size : int=32) -> float:
+        """
+        Fits the discard network on a prioritized sample of the replay buffer, then updates the sampled priorities with the new errors.
+        Returns the training loss.
+        """
+        indexes, inputs, actions, rewards, weights = replay_buffer.sample(batch_size)
+        targets = self._predict(inputs)
+        rows = np.arange(batch_size)
+        errors = rewards - targets[rows, actions]
+        targets[rows, actions] = rewards
+
+        loss = self._train_on_batch(inputs, targets, weights)
+        replay_buffer.update_priorities(indexes, errors)
+        return loss
+
+    def train_discard_model(self, hands: list[list[Card]], i: int, checkpoints : CheckpointManager=None, full_targets : bool=False,
+                            replay_buffer : PrioritizedReplayBuffer=None, metrics : MetricsWriter=None, crib_model : OpponentDiscardModel=None,
+                            replay : int=15, batch_size : int=32, memory_profiler : MemoryProfiler=None) -> tuple[float, float]:
         """
         Requires you to have played discard phases with the model, but trains the model using it's discard input history,
         target scores and chosen index to construct target vectors.
+        If a checkpoint manager is given, the model is checkpointed through it in the background instead of saved in place.
+        If full_targets is set, every one of the 15 outputs is trained on the score of its discard instead of only the chosen one.
+        If a replay buffer is given, each replay's transitions are added to it and the model is fit on a prioritized sample from it instead.
+        The buffer only holds the chosen discard's outcome, so it can't be combined with full_targets.
+        If a metrics writer is given, the batch's averages, loss, epsilon and step time are logged to it instead of appended to results.txt.
+        If a crib model is given, cribs are scored as their expectation over the opponent's discards instead of against one random adversary.
+        Each of the replay passes plays batch_size hands. Returns the batch's average tester and model scores.
+        If a memory profiler is given, every replay pass is a step of it.
         """
-        ### This is to be used if need to read from files instead of just reading from internal variables
-        
-        replay = 15
+        if full_targets and replay_buffer != None:
+            raise ValueError('A replay buffer only stores the chosen discard\'s outcome, so it can\'t be trained with full targets.')
+
         samples = list()
         model_avgs = list()
         tester_avgs = list()
+        losses = list()
+        start_time = time.perf_counter()
 
-        self._eps *= self._decay ** i
-        randomly_chosen = random.sample(hands, 32)
+        ### Set from the initial epsilon rather than decayed again, so a player trained over many batches follows the same schedule as fresh ones
+        self._eps = self._initial_eps * self._decay ** i
+        randomly_chosen = self._rng.sample(hands, batch_size)
         for hand in randomly_chosen:
             self._hand = Hand(hand.copy())
             samples.append(self._convert_hand_to_input(0, 0))
@@ -335,41 +506,102 @@ class NetworkPlayer(Player):
             model_scores = list()
             tester_scores = list()
             outputs = list()
+            replay_samples = list()
+            actions = list()
             for hand in randomly_chosen:
+                if full_targets:
+                    sample, targets, model_score, tester_score = self._full_discard_target(hand)
+                    replay_samples.append(sample)
+                    outputs.append(targets)
+                    model_scores.append(model_score)
+                    tester_scores.append(tester_score)
+                    actions.append(self._chosen_arg)
+                    continue
+
                 self._hand = Hand(hand.copy())
                 test_player = NaivePlayer()
                 test_player._hand = Hand(hand.copy())
                 adversary = NaivePlayer()
-                adversary._hand = Hand(random.choice(hands).copy())
+                adversary._hand = Hand(self._rng.choice(hands).copy())
 
-                dealer = random.randrange(0, 2)
+                dealer = self._rng.randrange(0, 2)
                 tester_discards = test_player.select_discards(0, 0)
                 self_discards = self.select_discards(dealer, 0, True)
                 adversary_discards = adversary.select_discards(0, 0)
 
 
-                tester_crib = Hand(tester_discards + adversary_discards)
-                self_crib = Hand(self_discards + adversary_discards)
+                if crib_model != None:
+                    tester_crib_score = crib_model.expected_crib(tester_discards, dealer)
+                    self_crib_score = crib_model.expected_crib(self_discards, dealer)
+                else:
+                    tester_crib_score = Hand(tester_discards + adversary_discards).score
+                    self_crib_score = Hand(self_discards + adversary_discards).score
 
                 if dealer:
-                    self._output_arr[self._chosen_arg] = self.hand.score + self_crib.score - adversary.hand.score
-                    model_scores.append(self.hand.score + self_crib.score - adversary.hand.score)
-                    tester_scores.append(test_player.hand.score + tester_crib.score - adversary.hand.score)
+                    self._output_arr[self._chosen_arg] = self.hand.score + self_crib_score - adversary.hand.score
+                    model_scores.append(self.hand.score + self_crib_score - adversary.hand.score)
+                    tester_scores.append(test_player.hand.score + tester_crib_score - adversary.hand.score)
                 else:
-                    self._output_arr[self._chosen_arg] = self.hand.score - self_crib.score - adversary.hand.score
-                    model_scores.append(self.hand.score - self_crib.score - adversary.hand.score)
-                    tester_scores.append(test_player.hand.score - tester_crib.score - adversary.hand.score)
+                    self._output_arr[self._chosen_arg] = self.hand.score - self_crib_score - adversary.hand.score
+                    model_scores.append(self.hand.score - self_crib_score - adversary.hand.score)
+                    tester_scores.append(test_player.hand.score - tester_crib_score - adversary.hand.score)
 
                 outputs.append(self._output_arr)
+                actions.append(self._chosen_arg)
 
             model_avgs.append(sum(model_scores) / len(model_scores))
             tester_avgs.append(sum(tester_scores) / len(tester_scores))
 
             outputs = tf.convert_to_tensor(outputs)
-            self._discard_network.fit(samples, outputs, batch_size=32, epochs=1, verbose=0)
+            fit_samples = tf.convert_to_tensor(replay_samples) if full_targets else samples
+            if replay_buffer != None:
+                ### The model's score for each hand is the outcome of the action it took
+                replay_buffer.add(fit_samples.numpy(), actions, model_scores)
+                losses.append(self._fit_from_replay(replay_buffer, batch_size))
+            else:
+                losses.append(self._train_on_batch(fit_samples, outputs))
+
+            if memory_profiler != None:
+                memory_profiler.step('train_discard_model')
         
 
-        with open('results.txt', 'a') as f:
-            f.write(str(sum(tester_avgs) / len(tester_avgs)) + ',' + str(sum(model_avgs) / len(model_avgs)) + '\n')
-        self._discard_network.save(f'network{i % 20}.h5')
+        tester_avg = sum(tester_avgs) / len(tester_avgs)
+        model_avg = sum(model_avgs) / len(model_avgs)
+        if metrics == None:
+            with open('results.txt', 'a') as f:
+                f.write(str(tester_avg) + ',' + str(model_avg) + '\n')
+        else:
+            metrics.log(tester_avg=tester_avg, model_avg=model_avg, loss=sum(losses) / len(losses), epsilon=self._eps,
+                        step_time=time.perf_counter() - start_time)
+
+        if checkpoints == None:
+            self._discard_network.save(f'network{i % 20}.h5')
+        else:
+            checkpoints.save(self._discard_network, i, {'tester_avg': tester_avg, 'model_avg': model_avg})
+
+        return tester_avg, model_avg
+
+
+    def train_discard_model_streaming(self, dataset : tf.data.Dataset, num_epochs : int, steps_per_epoch : int=15, checkpoints : CheckpointManager=None,
+                                      metrics : MetricsWriter=None, initial_epoch : int=0, memory_profiler : MemoryProfiler=None):
+        """
+        Trains the discard model on an endless dataset of (input, full target vector) batches, like the one from pipeline.discard_dataset,
+        so the next batches are simulated while the current one is being fit.
+        After every epoch of steps_per_epoch batches, the loss and average step time are logged and the model is checkpointed, as in train_discard_model.
+        If a memory profiler is given, every epoch is a step of it.
+        """
+        epoch_start = [time.perf_counter()]
+
+        def end_epoch(epoch : int, logs : dict):
+            if metrics != None:
+                metrics.log(loss=logs['loss'], step_time=(time.perf_counter() - epoch_start[0]) / steps_per_epoch)
+            if checkpoints == None:
+                self._discard_network.save(f'network{epoch % 20}.h5')
+            else:
+                checkpoints.save(self._discard_network, epoch, {'loss': logs['loss']})
+            if memory_profiler != None:
+                memory_profiler.step('train_discard_model_streaming')
+            epoch_start[0] = time.perf_counter()
 
+        self._discard_network.fit(dataset, epochs=initial_epoch + num_epochs, initial_epoch=initial_epoch, steps_per_epoch=steps_per_epoch,
+                                  verbose=0, callbacks=[tf.keras.callbacks.LambdaCallback(on_epoch_end=end_epoch)])
@@ -0,0 +1,141 @@
+import numpy as np
+
+
+
+class SumTree():
+    """
+    A binary tree stored in a flat array where every node holds the sum of its children's values.
+    Leaves are stored from index leaf_count onwards and the root is at index 1.
+    """
+    def __init__(self, capacity : int):
+        self._leaf_count = 1
+        while self._leaf_count < capacity:
+            self._leaf_count *= 2
+        self._depth = self._leaf_count.bit_length() - 1
+        self._nodes = np.zeros(2 * self._leaf_count, dtype=np.float64)
+
+    @property
+    def total(self) -> float:
+        """
+        Returns the sum of every leaf
+        """
+        return float(self._nodes[1])
+
+    def values(self, indexes : np.ndarray) -> np.ndarray:
+        """
+        Returns the values of the given leaves
+        """
+        return self._nodes[self._leaf_count + np.asarray(indexes)]
+
+    def update(self, indexes : np.ndarray, values : np.ndarray):
+        """
+        Sets the values of a batch of leaves, then recomputes their ancestors one level at a time
+        """
+        nodes = self._leaf_count + np.asarray(indexes)
+        self._nodes[nodes] = values
+        for _ in range(self._depth):
+            nodes = np.unique(nodes // 2)
+            self._nodes[nodes] = self._nodes[2 * nodes] + self._nodes[2 * nodes + 1]
+
+    def find(self, targets : np.ndarray) -> np.ndarray:
+        """
+        For each target in [0, total), returns the leaf where the running sum of leaf values passes it. Descends for all targets at once.
+        """
+        targets = np.array(targets, dtype=np.float64)
+        nodes = np.ones(len(targets), dtype=np.int64)
+        for _ in range(self._depth):
+            left = 2 * nodes
+            go_right = targets >= self._nodes[left]
+            targets = np.where(go_right, targets - self._nodes[left], targets)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self._leaf_count
+
+
+
+class PrioritizedReplayBuffer():
+    """
+    A fixed capacity replay memory of encoded discard transitions held in preallocated arrays.
+    Transitions are sampled proportionally to their priority through a sum tree, and the oldest are overwritten once it's full.
+    """
+    def __init__(self, capacity : int=100_000, input_size : int=321, alpha : float=0.6, beta : float=0.4, epsilon : float=1e-3):
+        """
+        Alpha controls how strongly priorities skew sampling, beta how strongly importance weights correct for it.
+        Epsilon keeps every transition's priority above zero.
+        """
+        self._capacity = capacity
+        self._alpha = alpha
+        self._beta = beta
+        self._epsilon = epsilon
+
+        self._inputs = np.zeros((capacity, input_size), dtype=np.float32)
+        self._actions = np.zeros((capacity,), dtype=np.int32)
+        self._rewards = np.zeros((capacity,), dtype=np.float32)
+        self._priorities = np.zeros((capacity,), dtype=np.float64)
+        self._tree = SumTree(capacity)
+
+        self._next = 0
+        self._size = 0
+        self._max_priority = 1.0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def capacity(self) -> int:
+        """
+        Returns the maximum number of transitions held
+        """
+        return self._capacity
+
+    def add(self, inputs : np.ndarray, actions : np.ndarray, rewards : np.ndarray, priorities : np.ndarray=None):
+        """
+        Adds a batch of transitions. Without explicit priorities they get the highest priority seen so far so they're sampled soon.
+        """
+        count = len(actions)
+        indexes = (self._next + np.arange(count)) % self._capacity
+        if priorities is None:
+            priorities = np.full(count, self._max_priority)
+
+        self._inputs[indexes] = inputs
+        self._actions[indexes] = actions
+        self._rewards[indexes] = rewards
+        self._set_priorities(indexes, np.asarray(priorities, dtype=np.float64))
+
+        self._next = (self._next + count) % self._capacity
+        self._size = min(self._size + count, self._capacity)
+
+    def _set_priorities(self, indexes : np.ndarray, priorities : np.ndarray):
+        """
+        Stores raw priorities and writes their scaled values into the sum tree
+        """
+        priorities = np.abs(priorities) + self._epsilon
+        self._priorities[indexes] = priorities
+        self._max_priority = max(self._max_priority, float(priorities.max()))
+        self._tree.update(indexes, priorities ** self._alpha)
+
+    def sample(self, batch_size : int, beta : float=None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Samples a batch proportionally to priority, drawing one transition from each of batch_size equal slices of the total priority.
+        Returns the indexes, inputs, actions, rewards and importance weights normalized so the largest weight is 1.
+        """
+        if self._size == 0:
+            raise ValueError("Can't sample from an empty replay buffer.")
+        beta = self._beta if beta == None else beta
+
+        total = self._tree.total
+        slice_size = total / batch_size
+        targets = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * slice_size
+        ### Floating point error can push a target past the last filled leaf, so keep it in range
+        indexes = np.minimum(self._tree.find(np.minimum(targets, np.nextafter(total, 0))), self._size - 1)
+
+        probabilities = self._tree.values(indexes) / total
+        weights = (self._size * probabilities) ** -beta
+        weights /= weights.max()
+
+        return indexes, self._inputs[indexes], self._actions[indexes], self._rewards[indexes], weights.astype(np.float32)
+
+    def update_priorities(self, indexes : np.ndarray, errors : np.ndarray):
+        """
+        Sets the priorities of sampled transitions from their new errors
+        """
+        self._set_priorities(np.asarray(indexes), np.asarray(errors, dtype=np.float64))
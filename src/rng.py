@@ -0,0 +1,119 @@
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import random
+
+
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+
+
+def _mix(value : int) -> int:
+    """
+    The SplitMix64 finalizer, scrambles a 64 bit value so that nearby inputs give unrelated outputs
+    """
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & _MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & _MASK
+    return value ^ (value >> 31)
+
+
+
+class CounterRandom(random.Random):
+    """
+    A counter based random number generator: its nth output is a hash of its key and n, so any position of a stream can be
+    computed without generating the ones before it. The key is derived from a seed and a stream number, so every
+    (seed, stream) pair is an independent stream. Everything random.Random offers (shuffle, choice, randrange, ...) works on it.
+    """
+    def __init__(self, seed : int=0, stream : int=0):
+        self._stream = stream
+        self._counter = 0
+        super().__init__(seed)
+
+    def seed(self, a : int=0, stream : int=None):
+        """
+        Restarts the generator at the start of the stream for the given seed, keeping the current stream number unless one is given.
+        Without a seed, like random.Random, one is drawn from the operating system.
+        """
+        if stream != None:
+            self._stream = stream
+        if a == None:
+            a = int.from_bytes(os.urandom(8), 'little')
+        self._key = _mix((_mix(a & _MASK) + self._stream * _GOLDEN) & _MASK)
+        self._counter = 0
+        self.gauss_next = None
+
+    @property
+    def counter(self) -> int:
+        """
+        Returns how many 64 bit words have been drawn from the stream
+        """
+        return self._counter
+
+    def _next_word(self) -> int:
+        """
+        Returns the 64 bit word at the current position of the stream and moves past it
+        """
+        self._counter += 1
+        return _mix((self._key + self._counter * _GOLDEN) & _MASK)
+
+    def random(self) -> float:
+        """
+        Returns a float in [0, 1) from the top 53 bits of the next word
+        """
+        return (self._next_word() >> 11) * (1.0 / (1 << 53))
+
+    def getrandbits(self, k : int) -> int:
+        """
+        Returns an int with k random bits, drawing as many words as needed
+        """
+        if k < 0:
+            raise ValueError('Number of bits must be non-negative.')
+        value = 0
+        bits = 0
+        while bits < k:
+            value |= self._next_word() << bits
+            bits += 64
+        return value & ((1 << k) - 1)
+
+    def getstate(self) -> tuple:
+        return self._key, self._counter, self.gauss_next, self._stream
+
+    def setstate(self, state : tuple):
+        self._key, self._counter, self.gauss_next, self._stream = state
+
+
+def game_rng(seed : int, game_index : int) -> CounterRandom:
+    """
+    Returns the random stream for the given game of a run, which depends on nothing but the run's seed and the game's index
+    """
+    return CounterRandom(seed, game_index)
+
+
+def shard_games(num_games : int, num_shards : int, shard : int) -> range:
+    """
+    Returns the indexes of the games the given shard plays when num_games games are split across num_shards shards
+    """
+    return range(shard, num_games, num_shards)
+
+
+def _play_indexed(play_game, seed : int, game_index : int):
+    """
+    Plays one game of a run with its own stream, so pools can call it by index
+    """
+    return play_game(game_rng(seed, game_index))
+
+
+def run_games(play_game, seed : int, game_indexes, num_workers : int=1) -> list:
+    """
+    Calls play_game with the stream of each of the given games and returns the results in the order of the indexes.
+    play_game must be a top level function when using more than one worker. As each game only sees its own stream,
+    the results are the same for any number of workers, and any one game can be replayed by passing just its index.
+    """
+    game_indexes = list(game_indexes)
+    if num_workers <= 1:
+        return [_play_indexed(play_game, seed, game_index) for game_index in game_indexes]
+
+    with ProcessPoolExecutor(num_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        chunksize = max(1, len(game_indexes) // (num_workers * 4))
+        return list(pool.map(_play_indexed, [play_game] * len(game_indexes), [seed] * len(game_indexes), game_indexes, chunksize=chunksize))
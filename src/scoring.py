@@ -1,5 +1,6 @@
-from src.card import Card, Face
+from src.card import Card, Face, Suit
 import itertools
+import numpy as np
 
 
 
@@ -16,6 +17,9 @@ class Hand():
     def __repr__(self) -> str:
         return str(self)
 
+    def __len__(self) -> int:
+        return len(self.cards)
+
     def _score_fifteens(self) -> int:
         """
         Scores all possible combinations summing to 15 in the hand
@@ -109,12 +113,23 @@ class Hand():
         """
         return self._cards
             
+    def contains(self, card : Card) -> bool:
+        """
+        Returns whether the hand holds this exact card, comparing both face and suit
+        """
+        return any(held.face == card.face and held.suit == card.suit for held in self.cards)
+            
     def discard(self, cards : list[Card]):
         """
-        Removes the cards passed in from the hand
+        Removes the cards passed in from the hand. Card equality only compares faces, so the card with the same face and suit is removed.
         """
         for card in cards:
-            self.cards.remove(card)
+            for i, held in enumerate(self.cards):
+                if held.face == card.face and held.suit == card.suit:
+                    del self.cards[i]
+                    break
+            else:
+                raise ValueError(str(card) + ' is not in the hand.')
 
     def add_cards(self, cards : list[Card]):
         """
@@ -122,6 +137,117 @@ class Hand():
         """
         self.cards.extend(cards)
 
+    def clear(self):
+        """
+        Removes every card from the hand
+        """
+        self.cards.clear()
+
+    def copy(self) -> 'Hand':
+        """
+        Returns a new hand holding the same cards
+        """
+        return Hand(self.cards.copy())
+
+
+
+### Shared card objects for the bitset containers to hand out, by card index
+_CARDS = [Card.from_index(index) for index in range(52)]
+
+
+def _cards_from_mask(mask : int) -> list[Card]:
+    """
+    Returns the cards whose index bits are set in the mask, in sorted order
+    """
+    cards = []
+    while mask:
+        lowest_bit = mask & -mask
+        cards.append(_CARDS[lowest_bit.bit_length() - 1])
+        mask ^= lowest_bit
+    return cards
+
+
+
+class BitHand(Hand):
+    """
+    A hand storing its cards as a 52 bit mask of card indexes, giving constant time adds, removes, membership tests and copies.
+    Its cards are always listed in sorted order. A card added on its own, like the starter card, is still scored as the start card.
+    """
+    def __init__(self, cards : list[Card]=None):
+        self._mask = 0
+        self._last_added = None
+        if cards != None:
+            self.add_cards(cards)
+
+    def __len__(self) -> int:
+        return bin(self._mask).count('1')
+
+    @property
+    def mask(self) -> int:
+        """
+        Returns the bit mask of the cards in the hand, where bit i is set if the card with index i is held
+        """
+        return self._mask
+
+    @property
+    def cards(self) -> list[Card]:
+        """
+        Returns a new sorted list of the cards in the hand. Changing the list doesn't change the hand.
+        """
+        return _cards_from_mask(self._mask)
+
+    @property
+    def score(self) -> int:
+        """
+        Return the score of the hand, with the last card added on its own scored as the start card
+        """
+        cards = self.cards
+        if len(cards) == 5 and self._last_added != None:
+            starter = _CARDS[self._last_added]
+            cards = [card for card in cards if card is not starter] + [starter]
+        return Hand(cards).score
+
+    def contains(self, card : Card) -> bool:
+        return bool(self._mask >> card.index & 1)
+
+    def discard(self, cards : list[Card]):
+        for card in cards:
+            bit = 1 << card.index
+            if not self._mask & bit:
+                raise ValueError(str(card) + ' is not in the hand.')
+            self._mask ^= bit
+            if card.index == self._last_added:
+                self._last_added = None
+
+    def add_cards(self, cards : list[Card]):
+        for card in cards:
+            self._mask |= 1 << card.index
+        self._last_added = cards[0].index if len(cards) == 1 else None
+
+    def clear(self):
+        self._mask = 0
+        self._last_added = None
+
+    def copy(self) -> 'BitHand':
+        hand = BitHand()
+        hand._mask = self._mask
+        hand._last_added = self._last_added
+        return hand
+
+    @property
+    def state(self) -> tuple[int, int]:
+        """
+        Returns the hand's mask and the index of the card added on its own (-1 if none), everything needed to restore it
+        """
+        return self._mask, -1 if self._last_added == None else self._last_added
+
+    def restore(self, state : tuple[int, int]):
+        """
+        Puts the hand back to a state returned by the state property
+        """
+        self._mask = state[0]
+        self._last_added = None if state[1] < 0 else state[1]
+
 
 
 class PeggingPile():
@@ -186,8 +312,9 @@ class PeggingPile():
         for i in range(10, 2, -1):
             ### If you've already scored, that means you've gotten the maximum amount of points for your run, so just keep iterating
             if len(self.cards_in_play) >= i and score == 0:
-                check_cards = sorted([card.rank for card in self.cards_in_play])[-i:]
-                if (check_cards[-1].rank - len(check_cards) + 1 == check_cards[0].rank):
+                ### The last i cards played make a run if their ranks are all different and span exactly i ranks
+                check_cards = sorted([card.rank for card in self.cards_in_play[-i:]])
+                if len(set(check_cards)) == i and check_cards[-1] - i + 1 == check_cards[0]:
                     score += i
 
         return score
@@ -228,6 +355,54 @@ class PeggingPile():
         score += self._score_runs()
         return score
 
+    def evaluate_plays(self, cards : list[Card]) -> tuple[list[int], list[bool]]:
+        """
+        Returns the points each of the given cards would score if played next, and whether each can be played at all,
+        without changing the pile. Everything the cards are checked against is worked out once from the cards in play.
+        Cards that can't be played score 0.
+        """
+        total = self.current_total
+        ranks = [card.rank for card in self.cards_in_play]
+
+        ### How many cards at the end of play share the last card's rank
+        same_rank = 0
+        for rank in reversed(ranks):
+            if rank != ranks[-1]:
+                break
+            same_rank += 1
+
+        ### For every run length, the ranks of the cards in play that the next card would make the run with, if they're all different
+        run_ranks = []
+        seen = set()
+        for rank in reversed(ranks[-9:]):
+            if rank in seen:
+                break
+            seen.add(rank)
+            run_ranks.append((len(seen) + 1, min(seen), max(seen), frozenset(seen)))
+        run_ranks.reverse()
+
+        points = []
+        legal = []
+        for card in cards:
+            new_total = total + card.value
+            if new_total > 31:
+                points.append(0)
+                legal.append(False)
+                continue
+
+            card_points = 2 if new_total == 15 or new_total == 31 else 0
+            if same_rank > 0 and card.rank == ranks[-1]:
+                card_points += (0, 2, 6, 12)[min(same_rank, 3)]
+            ### The longest run the card completes is the one that's scored
+            for length, lowest, highest, run in run_ranks:
+                if length >= 3 and card.rank not in run and max(highest, card.rank) - min(lowest, card.rank) == length - 1:
+                    card_points += length
+                    break
+            points.append(card_points)
+            legal.append(True)
+
+        return points, legal
+
     def end_current_play(self):
         """
         Sends all current cards in play to the pile of cards not in play
@@ -243,6 +418,7 @@ class PeggingPile():
         if card.value + self.current_total > 31:
             raise ValueError("You cannot play that card! Please select another card.")
 
+        self._cards_in_play.append(card)
         score = self.score
 
         if self.current_total == 31:
@@ -257,4 +433,222 @@ class PeggingPile():
         self.end_current_play()
         dead_cards = self.dead_cards.copy()
         self.dead_cards.clear()
-        return dead_cards
\ No newline at end of file
+        return dead_cards
+
+
+
+class BitPeggingPile(PeggingPile):
+    """
+    A pegging pile that also keeps bit masks of the cards in play and dead cards, and a running total of the cards in play.
+    Cards in play keep the order they were played in since pegging scores depend on it.
+    """
+    def __init__(self, cards : list[Card]=None):
+        super().__init__(None if cards == None else list(cards))
+        self._in_play_mask = 0
+        self._dead_mask = 0
+        self._total = 0
+        for card in self._cards_in_play:
+            self._in_play_mask |= 1 << card.index
+            self._total += card.value
+
+    @property
+    def current_total(self) -> int:
+        return self._total
+
+    def contains(self, card : Card) -> bool:
+        """
+        Returns whether this exact card has been played, whether it's still in play or dead
+        """
+        return bool((self._in_play_mask | self._dead_mask) >> card.index & 1)
+
+    def end_current_play(self):
+        super().end_current_play()
+        self._dead_mask |= self._in_play_mask
+        self._in_play_mask = 0
+        self._total = 0
+
+    def add_to_play(self, card : Card) -> int:
+        if card.value + self._total > 31:
+            raise ValueError("You cannot play that card! Please select another card.")
+
+        self._cards_in_play.append(card)
+        self._in_play_mask |= 1 << card.index
+        self._total += card.value
+        score = self.score
+
+        if self._total == 31:
+            self.end_current_play()
+
+        return score
+
+    def end_pegging(self) -> list[Card]:
+        dead_cards = super().end_pegging()
+        self._dead_mask = 0
+        return dead_cards
+
+    @property
+    def state(self) -> tuple[bytes, bytes]:
+        """
+        Returns the indexes of the cards in play and of the dead cards, in the order they were played
+        """
+        return bytes(card.index for card in self._cards_in_play), bytes(card.index for card in self._dead_cards)
+
+    def restore(self, state : tuple[bytes, bytes]):
+        """
+        Puts the pile back to a state returned by the state property
+        """
+        in_play, dead = state
+        self._cards_in_play = [_CARDS[index] for index in in_play]
+        self._dead_cards = [_CARDS[index] for index in dead]
+        self._in_play_mask = 0
+        self._dead_mask = 0
+        self._total = 0
+        for index in in_play:
+            self._in_play_mask |= 1 << index
+            self._total += _CARDS[index].value
+        for index in dead:
+            self._dead_mask |= 1 << index
+
+
+
+def _run_score(rank_counts : list[int]) -> int:
+    """
+    Scores the runs of a hand from how many cards it has of each rank, each run counting once for every way of picking its cards
+    """
+    for length in range(5, 2, -1):
+        score = 0
+        for start in range(13 - length + 1):
+            ways = 1
+            for count in rank_counts[start:start + length]:
+                ways *= count
+                if ways == 0:
+                    break
+            score += length * ways
+        if score > 0:
+            return score
+    return 0
+
+
+def starter_sweep(cards : list[Card], excluded : list[Card]=None) -> tuple[list[Card], list[int]]:
+    """
+    Scores the given cards with every possible starter card at once, the same as Hand(cards + [starter]).score.
+    Starters are every card not among the cards or the excluded cards. Fifteens, pairs and runs only depend on the starter's rank
+    and flushes and nobs on its suit, so those are worked out once per rank and suit from the cards' subset sums and rank counts.
+    Returns the starters and their scores.
+    """
+    values = [card.value for card in cards]
+    ranks = [card.rank for card in cards]
+    suits = [card.suit for card in cards]
+
+    ### How many subsets of the cards add up to each total up to 15, including the empty subset
+    subset_sums = [1] + [0] * 15
+    for value in values:
+        for total in range(15, value - 1, -1):
+            subset_sums[total] += subset_sums[total - value]
+
+    rank_counts = [0] * 13
+    for rank in ranks:
+        rank_counts[rank - 1] += 1
+    pairs = sum(count * (count - 1) for count in rank_counts)
+
+    rank_scores = []
+    for rank in range(1, 14):
+        value = min(rank, 10)
+        rank_counts[rank - 1] += 1
+        ### Each fifteen with the starter is a subset of the cards adding up to 15 minus its value
+        fifteens = 2 * (subset_sums[15] + subset_sums[15 - value])
+        rank_scores.append(fifteens + pairs + 2 * (rank_counts[rank - 1] - 1) + _run_score(rank_counts))
+        rank_counts[rank - 1] -= 1
+
+    ### Flushes follow Hand's rules, where a fifth card only counts as the starter
+    same_suit = len(set(suits)) <= 1
+    suit_scores = dict()
+    for suit in Suit:
+        if len(cards) == 4:
+            flush = (5 if suits[0] == suit else 4) if same_suit else 0
+            nob = sum(1 for card in cards if card.face == Face.JACK and card.suit == suit)
+        else:
+            flush = 4 if same_suit and (len(cards) == 0 or suits[0] == suit) else 0
+            nob = 0
+        suit_scores[suit] = flush + nob
+
+    held = set(card.index for card in cards + ([] if excluded == None else excluded))
+    starters = [card for card in _CARDS if card.index not in held]
+    return starters, [rank_scores[starter.rank - 1] + suit_scores[starter.suit] for starter in starters]
+
+
+def keep_starter_scores(kept : list[Card], discards : list[Card]=None, crib : list[Card]=None) -> tuple[list[Card], list[int], list[int]]:
+    """
+    Scores the four kept cards, and optionally the whole crib of four cards, with every starter card that isn't among the kept cards,
+    the discards or the crib, so four kept cards and their two discards have 46 starters.
+    Returns the starters, the hand's score with each, and the crib's score with each (None without a crib),
+    the same as Hand(kept + [starter]).score and Hand(crib + [starter]).score.
+    """
+    discards = [] if discards == None else discards
+    if crib == None:
+        return starter_sweep(kept, discards) + (None,)
+    ### Two discards on their own can still score a flush, so only the crib of both players' discards is a crib score
+    if len(crib) != 4:
+        raise ValueError(f'A crib has 4 cards, not {len(crib)}.')
+    starters, hand_scores = starter_sweep(kept, discards + crib)
+    _, crib_scores = starter_sweep(crib, kept + discards)
+    return starters, hand_scores, crib_scores
+
+
+JACK_RANK = 11
+### Built on first use, the fifteens, pairs and runs score of every tuple of num_cards zero based ranks
+_RANK_TABLES = dict()
+
+
+def _rank_table(num_cards : int) -> np.ndarray:
+    """
+    Returns the fifteens, pairs and runs score of every tuple of num_cards ranks, indexed by the ranks as base 13 digits
+    """
+    if num_cards in _RANK_TABLES:
+        return _RANK_TABLES[num_cards]
+
+    ranks = np.indices((13,) * num_cards).reshape(num_cards, -1).T
+    values = np.minimum(ranks + 1, 10)
+
+    subsets = np.array(list(itertools.product((0, 1), repeat=num_cards)))
+    fifteens = 2 * ((values @ subsets.T) == 15).sum(axis=1)
+
+    pairs = sum(2 * (ranks[:, i] == ranks[:, j]) for i, j in itertools.combinations(range(num_cards), 2))
+
+    ### A run scores its length once for every way of picking one card of each of its ranks, only the longest runs count
+    counts = np.zeros((len(ranks), 13), dtype=np.int64)
+    for i in range(num_cards):
+        counts[np.arange(len(ranks)), ranks[:, i]] += 1
+    runs = np.zeros(len(ranks), dtype=np.int64)
+    for length in range(num_cards, 2, -1):
+        length_score = np.zeros(len(ranks), dtype=np.int64)
+        for start in range(13 - length + 1):
+            length_score += length * counts[:, start:start + length].prod(axis=1)
+        runs = np.where(runs == 0, length_score, runs)
+
+    _RANK_TABLES[num_cards] = (fifteens + pairs + runs).astype(np.int16)
+    return _RANK_TABLES[num_cards]
+
+
+def score_hands(cards : np.ndarray) -> np.ndarray:
+    """
+    Scores many hands at once, the same as Hand.score. cards holds card indexes with one hand per row,
+    and rows of five cards have the starter card last.
+    """
+    cards = np.asarray(cards)
+    num_cards = cards.shape[1]
+    ranks = cards % 13
+    suits = cards // 13
+
+    key = np.zeros(len(cards), dtype=np.int64)
+    for i in range(num_cards):
+        key = key * 13 + ranks[:, i]
+    score = _rank_table(num_cards)[key].astype(np.int64)
+
+    held_flush = (suits[:, :4] == suits[:, :1]).all(axis=1)
+    score += 4 * held_flush
+    if num_cards == 5:
+        score += held_flush & (suits[:, 4] == suits[:, 0])
+        ### Nob, a held jack of the starter's suit
+        score += ((ranks[:, :4] == JACK_RANK - 1) & (suits[:, :4] == suits[:, 4:5])).any(axis=1)
+    return score
@@ -0,0 +1,63 @@
+from multiprocessing import shared_memory
+import numpy as np
+
+
+
+class SharedArrays():
+    """
+    Numpy arrays laid out one after another in a single shared memory block.
+    Subclasses describe their arrays in _layout and set whatever _layout depends on before calling __init__.
+    Pickling sends the block's name along with the rest of the instance's attributes, and unpickling attaches to the same block,
+    so the arrays are shared between processes rather than copied.
+    """
+    def __init__(self):
+        size = sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in self._layout())
+        self._memory = shared_memory.SharedMemory(create=True, size=size)
+        self._attach()
+
+    def __getstate__(self) -> dict:
+        state = {name: value for name, value in self.__dict__.items() if name not in self._array_names() and name != '_memory'}
+        state['_memory_name'] = self._memory.name
+        return state
+
+    def __setstate__(self, state : dict):
+        state = dict(state)
+        self._memory = shared_memory.SharedMemory(name=state.pop('_memory_name'))
+        self.__dict__.update(state)
+        self._attach()
+
+    def _layout(self) -> list[tuple[str, tuple, type]]:
+        """
+        Returns the attribute name, shape and dtype of each array in the order they are laid out in the block
+        """
+        raise NotImplementedError
+
+    def _array_names(self) -> list[str]:
+        """
+        Returns the attribute names of the arrays
+        """
+        return [name for name, _, _ in self._layout()]
+
+    def _attach(self):
+        """
+        Creates the numpy views onto the shared memory block
+        """
+        offset = 0
+        for name, shape, dtype in self._layout():
+            array = np.ndarray(shape, dtype=dtype, buffer=self._memory.buf, offset=offset)
+            setattr(self, name, array)
+            offset += array.nbytes
+
+    def close(self):
+        """
+        Detaches this process from the shared memory
+        """
+        for name in self._array_names():
+            setattr(self, name, None)
+        self._memory.close()
+
+    def unlink(self):
+        """
+        Frees the shared memory, only to be called by the process that created it once everyone is done with it
+        """
+        self._memory.unlink()
@@ -0,0 +1,130 @@
+import json
+import multiprocessing
+import os
+import random
+import statistics
+
+
+
+### An example search space, each hyperparameter maps to the values a trial can be given
+SEARCH_SPACE = {
+    'layer_widths': [(56, 56, 25, 20), (128, 64, 32), (64, 32), (256, 128, 64, 32)],
+    'learning_rate': [0.0003, 0.001, 0.003],
+    'eps': [0.5, 0.8, 1.0],
+    'decay': [0.8, 0.9, 0.95],
+    'replay': [5, 15, 30],
+    'batch_size': [16, 32, 64],
+}
+
+### The hyperparameters passed to the NetworkPlayer, the rest are passed to train_discard_model
+_PLAYER_PARAMETERS = ('layer_widths', 'learning_rate', 'eps', 'decay')
+
+
+def sample_configs(search_space : dict, num_trials : int, seed : int=None) -> list[dict]:
+    """
+    Samples num_trials random configurations from the search space
+    """
+    rng = random.Random(seed)
+    return [{name: rng.choice(values) for name, values in search_space.items()} for _ in range(num_trials)]
+
+
+
+class MedianPruner():
+    """
+    Prunes a trial when its metric at a step is below the median of the other trials' metrics at the same step.
+    Nothing is pruned during the first warmup_steps steps, or before min_trials other trials have reached the step.
+    """
+    def __init__(self, warmup_steps : int=5, min_trials : int=3):
+        self._warmup_steps = warmup_steps
+        self._min_trials = min_trials
+
+    def should_prune(self, reports : dict, trial : int, step : int) -> bool:
+        """
+        reports maps each trial to the list of metrics it has reported so far, one per step
+        """
+        if step < self._warmup_steps:
+            return False
+        others = [values[step] for other, values in reports.items() if other != trial and len(values) > step]
+        if len(others) < self._min_trials:
+            return False
+        return reports[trial][step] < statistics.median(others)
+
+
+
+def _run_trial(trial : int, config : dict, hands : list, num_batches : int, directory : str, cpu_slots, threads_per_trial : int,
+               reports, pruner : MedianPruner) -> dict:
+    """
+    Trains a network player with the trial's configuration, pinned to a free slot of CPUs with TF limited to that many threads.
+    Reports the model's lead over the naive tester after every batch and stops early if the pruner says so.
+    """
+    cpus = cpu_slots.get()
+    try:
+        if hasattr(os, 'sched_setaffinity'):
+            os.sched_setaffinity(0, cpus)
+
+        ### TF's thread pools can only be sized before it first runs anything, so this needs a fresh process per trial
+        import tensorflow as tf
+        tf.config.threading.set_intra_op_parallelism_threads(threads_per_trial)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+        from src.player import NetworkPlayer
+        from src.checkpoint import CheckpointManager
+        from src.metrics import MetricsWriter
+
+        trial_directory = os.path.join(directory, f'trial{trial}')
+        trainee = NetworkPlayer(f'Trial {trial}', **{name: config[name] for name in _PLAYER_PARAMETERS if name in config})
+        training_parameters = {name: value for name, value in config.items() if name not in _PLAYER_PARAMETERS}
+        checkpoints = CheckpointManager(os.path.join(trial_directory, 'checkpoints'), keep_last=1, keep_best=1, best_metric='model_avg')
+        metrics = MetricsWriter(os.path.join(trial_directory, 'metrics'), flush_every=1)
+
+        leads = list()
+        pruned = False
+        for i in range(num_batches):
+            tester_avg, model_avg = trainee.train_discard_model(hands, i, checkpoints, metrics=metrics, **training_parameters)
+            leads.append(model_avg - tester_avg)
+            ### Manager dicts only see a change when the value is reassigned
+            reports[trial] = list(leads)
+            if pruner != None and pruner.should_prune(dict(reports), trial, i):
+                pruned = True
+                break
+
+        metrics.close()
+        checkpoints.close()
+        ### The average over the last few batches, as single batches are noisy
+        recent = leads[-5:]
+        return {'trial': trial, 'config': config, 'score': sum(recent) / len(recent), 'steps': len(leads), 'pruned': pruned}
+    finally:
+        cpu_slots.put(cpus)
+
+
+def run_sweep(hands : list, configs : list[dict], num_batches : int=100, directory : str='sweep', num_workers : int=None,
+              threads_per_trial : int=1, pruner : MedianPruner=None) -> list[dict]:
+    """
+    Runs a training trial for each configuration across a pool of num_workers processes, each trial getting threads_per_trial CPUs
+    of its own so concurrent trials don't oversubscribe the machine. Every trial runs in a new process, checkpoints and logs
+    metrics under its own directory, and may be pruned early.
+    Returns each trial's result, best score first, and writes them to results.json in the directory.
+    """
+    cpus = sorted(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else list(range(os.cpu_count()))
+    num_workers = max(1, len(cpus) // threads_per_trial) if num_workers == None else num_workers
+    os.makedirs(directory, exist_ok=True)
+
+    context = multiprocessing.get_context('spawn')
+    with context.Manager() as manager:
+        ### Each worker takes a slot of CPUs for the length of a trial, slots wrap around if there are more workers than CPUs allow
+        cpu_slots = manager.Queue()
+        for worker in range(num_workers):
+            start = worker * threads_per_trial
+            cpu_slots.put({cpus[(start + offset) % len(cpus)] for offset in range(threads_per_trial)})
+        reports = manager.dict()
+
+        ### maxtasksperchild gives every trial a new process, which ProcessPoolExecutor only supports from python 3.11
+        with context.Pool(num_workers, maxtasksperchild=1) as pool:
+            pending = [pool.apply_async(_run_trial, (trial, config, hands, num_batches, directory, cpu_slots, threads_per_trial, reports, pruner))
+                       for trial, config in enumerate(configs)]
+            results = [result.get() for result in pending]
+
+    results.sort(key=lambda result: result['score'], reverse=True)
+    with open(os.path.join(directory, 'results.json'), 'w') as f:
+        json.dump(results, f, indent=2)
+    return results
@@ -0,0 +1,291 @@
+from src.cribbage_game import CribbageGame
+from src.discards import DISCARD_OPTIONS
+from src.player import Player, RandomPlayer, NaivePlayer
+from src.rng import CounterRandom
+from src.shared_arrays import SharedArrays
+import multiprocessing
+import numpy as np
+
+
+
+DISCARD_PHASE = 0
+PEGGING_PHASE = 1
+### Discard actions are discard options of the six sorted cards, pegging actions are positions in the sorted cards left to peg
+NUM_ACTIONS = len(DISCARD_OPTIONS)
+MAX_CARDS_IN_PLAY = 8
+### Observation layout: phase, six card ids of the hand (0 for an empty slot), dealer flag, score / 121, opponent score / 121,
+### starter id (0 before it's cut), pegging total / 31, ids of the cards in play, cards the opponent has left to peg / 4
+_HAND = slice(1, 7)
+_DEALER = 7
+_SCORE = 8
+_OPP_SCORE = 9
+_STARTER = 10
+_PEGGING_TOTAL = 11
+_IN_PLAY = slice(12, 12 + MAX_CARDS_IN_PLAY)
+_OPP_CARDS_LEFT = 12 + MAX_CARDS_IN_PLAY
+OBSERVATION_SIZE = _OPP_CARDS_LEFT + 1
+
+
+
+class CribbageEnv():
+    """
+    A single game of cribbage against a built in opponent, played through discard and pegging decisions.
+    The agent is player one. Observations are written into the given arrays rather than returned, so they can be shared memory.
+    Each step's reward is the change in the agent's lead, and a finished game is followed by a new one straight away.
+    """
+    def __init__(self, observation : np.ndarray, mask : np.ndarray, opponent : Player=None, seed : int=0, stream : int=0, winning_score : int=121):
+        self._observation = observation
+        self._mask = mask
+        self._agent = RandomPlayer('Agent')
+        self._opponent = NaivePlayer('Opponent') if opponent == None else opponent
+        self._game = CribbageGame(self._agent, self._opponent, winning_score, rng=CounterRandom(seed, stream))
+        self._phase = DISCARD_PHASE
+        self._pegging_hands = [[], []]
+        self._pegging_turn = 0
+        self._last_to_play = 0
+
+    def _agent_dealer(self) -> int:
+        return 1 if self._game.dealer is self._agent else 0
+
+    def _lead(self) -> int:
+        return self._agent.score - self._opponent.score
+
+    def _game_over(self) -> bool:
+        return self._game.get_winner() != None
+
+    def _start_round(self):
+        """
+        Shuffles and deals a round, leaving the agent to discard
+        """
+        self._game.initialize_round()
+        self._game.deal_cards()
+        self._phase = DISCARD_PHASE
+
+    def reset(self):
+        """
+        Starts a new game and writes its first observation
+        """
+        ### Pegged cards are still in the hands, so they must not go back to the deck from the pile too
+        self._game.pegging_pile.end_pegging()
+        self._game.start_new_game()
+        self._start_round()
+        self._write_observation()
+
+    def step(self, action : int) -> tuple[float, bool]:
+        """
+        Plays the agent's action and the opponent's replies up to the agent's next decision, writing its observation.
+        Returns the reward and whether the game ended, in which case the observation is already the new game's.
+        """
+        if not self._mask[action]:
+            raise ValueError(f'Action {action} is not legal.')
+        lead = self._lead()
+
+        if self._phase == DISCARD_PHASE:
+            self._discard(action)
+        else:
+            self._play(0, self._pegging_hands[0][action])
+        self._advance()
+
+        reward = self._lead() - lead
+        done = self._game_over()
+        if done:
+            self.reset()
+        else:
+            self._write_observation()
+        return float(reward), done
+
+    def _discard(self, option : int):
+        """
+        Makes the agent's discards and the opponent's, puts them in the crib, and starts pegging with the non dealer
+        """
+        cards = self._agent.hand.cards
+        agent_discards = [cards[i] for i in DISCARD_OPTIONS[option]]
+        self._agent.hand.discard(agent_discards)
+        opponent_discards = self._opponent.select_discards((self._agent_dealer() + 1) % 2, self._agent.score)
+        self._game.add_discards(agent_discards, opponent_discards)
+
+        self._phase = PEGGING_PHASE
+        self._pegging_hands = [self._agent.hand.cards, self._opponent.hand.cards]
+        self._pegging_turn = 0 if self._game.non_dealer is self._agent else 1
+        self._last_to_play = self._pegging_turn
+
+    def _play(self, player_index : int, card):
+        """
+        Plays a card from the player's pegging hand and scores it
+        """
+        hand = self._pegging_hands[player_index]
+        hand.pop(next(i for i, held in enumerate(hand) if held is card))
+        points = self._game.pegging_pile.add_to_play(card)
+        (self._agent, self._opponent)[player_index].score_points(points)
+        self._last_to_play = player_index
+        self._pegging_turn = (player_index + 1) % 2
+
+    def _can_play(self, player_index : int) -> bool:
+        total = self._game.pegging_pile.current_total
+        return any(card.value + total <= 31 for card in self._pegging_hands[player_index])
+
+    def _advance(self):
+        """
+        Plays the opponent's pegging and the scoring of the round until the agent has a decision to make or the game is over
+        """
+        pile = self._game.pegging_pile
+        while self._phase == PEGGING_PHASE and not self._game_over():
+            turn = self._pegging_turn
+            if self._can_play(turn):
+                if turn == 0:
+                    return
+                self._play(1, self._opponent_peg_card())
+            elif self._can_play((turn + 1) % 2):
+                self._pegging_turn = (turn + 1) % 2
+            else:
+                ### Nobody can play, so the last player to play scores a go, or the last card, unless the play ended on 31
+                if len(pile.cards_in_play) > 0:
+                    (self._agent, self._opponent)[self._last_to_play].score_points(1)
+                    pile.end_current_play()
+                if len(self._pegging_hands[0]) + len(self._pegging_hands[1]) == 0:
+                    self._end_round()
+                else:
+                    self._pegging_turn = (self._last_to_play + 1) % 2
+
+    def _opponent_peg_card(self):
+        """
+        Returns the card the opponent's pegging policy plays from its pegging hand
+        """
+        hand = self._opponent.hand
+        self._opponent._hand = type(hand)(list(self._pegging_hands[1]))
+        try:
+            return self._opponent.select_peg_card(self._game.pegging_pile, self._agent.score)
+        finally:
+            self._opponent._hand = hand
+
+    def _end_round(self):
+        """
+        Scores the hands and crib after pegging and deals the next round if nobody has won
+        """
+        self._game.pegging_pile.end_pegging()
+        self._game.score_non_dealer()
+        if not self._game_over():
+            self._game.score_dealer()
+            self._game.score_crib()
+        if not self._game_over():
+            self._game.reset_game()
+            self._start_round()
+
+    def _write_observation(self):
+        observation = self._observation
+        observation[:] = 0.0
+        observation[0] = self._phase
+        observation[_DEALER] = self._agent_dealer()
+        observation[_SCORE] = self._agent.score / 121.0
+        observation[_OPP_SCORE] = self._opponent.score / 121.0
+        self._mask[:] = False
+
+        if self._phase == DISCARD_PHASE:
+            cards = self._agent.hand.cards
+            self._mask[:] = True
+        else:
+            cards = sorted(self._pegging_hands[0])
+            self._pegging_hands[0] = cards
+            pile = self._game.pegging_pile
+            observation[_STARTER] = self._game.deck.cards[-1].index + 1
+            observation[_PEGGING_TOTAL] = pile.current_total / 31.0
+            in_play = [card.index + 1 for card in pile.cards_in_play[-MAX_CARDS_IN_PLAY:]]
+            observation[_IN_PLAY.start:_IN_PLAY.start + len(in_play)] = in_play
+            observation[_OPP_CARDS_LEFT] = len(self._pegging_hands[1]) / 4.0
+            self._mask[:len(cards)] = [card.value + pile.current_total <= 31 for card in cards]
+        observation[_HAND.start:_HAND.start + len(cards)] = [card.index + 1 for card in cards]
+
+
+
+class SharedEnvArrays(SharedArrays):
+    """
+    The observations, action masks, actions, rewards and done flags of every environment, kept in one shared memory block
+    """
+    def __init__(self, num_envs : int):
+        self._num_envs = num_envs
+        super().__init__()
+
+    def _layout(self) -> list[tuple[str, tuple, type]]:
+        count = self._num_envs
+        return [('observations', (count, OBSERVATION_SIZE), np.float32), ('rewards', (count,), np.float32), ('actions', (count,), np.int32),
+                ('masks', (count, NUM_ACTIONS), np.bool_), ('dones', (count,), np.bool_)]
+
+
+def _run_env_worker(connection, arrays : SharedEnvArrays, env_indexes : range, seed : int, winning_score : int):
+    """
+    Runs a slice of the environments, stepping them whenever told to with the actions in shared memory
+    """
+    envs = [CribbageEnv(arrays.observations[i], arrays.masks[i], seed=seed, stream=i, winning_score=winning_score) for i in env_indexes]
+    while True:
+        command = connection.recv()
+        if command == 'reset':
+            for env in envs:
+                env.reset()
+        elif command == 'step':
+            for i, env in zip(env_indexes, envs):
+                arrays.rewards[i], arrays.dones[i] = env.step(int(arrays.actions[i]))
+        else:
+            break
+        connection.send(None)
+    arrays.close()
+    connection.close()
+
+
+
+class VectorEnv():
+    """
+    Runs num_envs cribbage environments across num_workers subprocesses. Actions go to the workers and observations,
+    action masks, rewards and done flags come back through shared memory, so only a short command is ever pickled per step.
+    The returned arrays are views onto the shared memory, overwritten by the next step, so copy them to keep them.
+    With the same seed, every environment plays the same games whatever the number of workers.
+    """
+    def __init__(self, num_envs : int, num_workers : int=4, seed : int=0, winning_score : int=121):
+        ### Workers are spawned rather than forked since tensorflow may already be initialized in this process
+        context = multiprocessing.get_context('spawn')
+        self._arrays = SharedEnvArrays(num_envs)
+        self._connections = []
+        self._workers = []
+        num_workers = min(num_workers, num_envs)
+        for worker in range(num_workers):
+            env_indexes = range(worker * num_envs // num_workers, (worker + 1) * num_envs // num_workers)
+            connection, worker_connection = context.Pipe()
+            process = context.Process(target=_run_env_worker, args=[worker_connection, self._arrays, env_indexes, seed, winning_score], daemon=True)
+            process.start()
+            self._connections.append(connection)
+            self._workers.append(process)
+
+    @property
+    def num_envs(self) -> int:
+        return len(self._arrays.rewards)
+
+    def _broadcast(self, command : str):
+        for connection in self._connections:
+            connection.send(command)
+        for connection in self._connections:
+            connection.recv()
+
+    def reset(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Starts a new game in every environment and returns the observations and action masks
+        """
+        self._broadcast('reset')
+        return self._arrays.observations, self._arrays.masks
+
+    def step(self, actions : np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Plays one action in every environment and returns the observations, action masks, rewards and done flags
+        """
+        self._arrays.actions[:] = actions
+        self._broadcast('step')
+        return self._arrays.observations, self._arrays.masks, self._arrays.rewards, self._arrays.dones
+
+    def close(self):
+        """
+        Stops the workers and frees the shared memory
+        """
+        for connection in self._connections:
+            connection.send('close')
+        for process in self._workers:
+            process.join()
+        self._arrays.close()
+        self._arrays.unlink()